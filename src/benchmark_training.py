@@ -0,0 +1,51 @@
+'''
+Compare the training throughput of NeuroNER for several values of a parameter, e.g. number_of_workers or character_encoder.
+
+Each configuration is trained for a single epoch in a separate process, and the training throughput (sentences per second)
+recorded in results.json is reported with the speed-up relative to the first configuration:
+
+    python benchmark_training.py --parameters_filepath ./parameters.ini --parameter_name number_of_workers --parameter_values 1 2 4 8
+    python benchmark_training.py --parameters_filepath ./parameters.ini --parameter_name character_encoder --parameter_values lstm cnn
+
+Any other argument is passed to main.py for all the configurations.
+'''
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+def get_training_throughput(parameters_filepath, parameter_name, parameter_value, extra_arguments):
+    output_folder = tempfile.mkdtemp(prefix='neuroner_benchmark_')
+    command = [sys.executable, 'main.py', '--parameters_filepath', parameters_filepath, '--output_folder', output_folder,
+               '--maximum_number_of_epochs', '1', '--{0}'.format(parameter_name), str(parameter_value)] + extra_arguments
+    subprocess.check_call(command, cwd=os.path.dirname(os.path.abspath(__file__)))
+    results_filepath = glob.glob(os.path.join(output_folder, '*', 'results.json'))[0]
+    with open(results_filepath, 'r') as f:
+        results = json.load(f)
+    return results['epoch']['1'][0]['training_throughput']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the training throughput of NeuroNER')
+    parser.add_argument('--parameters_filepath', required=False, default=os.path.join('.','parameters.ini'))
+    parser.add_argument('--parameter_name', required=False, default='number_of_workers')
+    parser.add_argument('--parameter_values', required=False, nargs='+', default=['1', '2', '4'])
+    arguments, extra_arguments = parser.parse_known_args()
+
+    parameter_name = arguments.parameter_name
+    parameter_values = arguments.parameter_values
+    training_throughputs = []
+    for parameter_value in parameter_values:
+        training_throughputs.append(get_training_throughput(arguments.parameters_filepath, parameter_name, parameter_value, extra_arguments))
+
+    print('\n{0:>20} {1:>25} {2:>10}'.format(parameter_name, 'throughput (sentences/s)', 'speed-up'))
+    for parameter_value, training_throughput in zip(parameter_values, training_throughputs):
+        print('{0:>20} {1:>25.1f} {2:>10.2f}'.format(parameter_value, training_throughput, training_throughput / training_throughputs[0]))
+
+
+if __name__ == '__main__':
+    main()
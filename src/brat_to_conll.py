@@ -13,8 +13,9 @@ def get_start_and_end_offset_of_token_from_spacy(token):
     end = start + len(token)
     return start, end
 
-def get_sentences_and_tokens_from_spacy(text, spacy_nlp):
-    document = spacy_nlp(text)
+def get_sentences_and_tokens_from_spacy(text, spacy_nlp, document=None):
+    if document is None:
+        document = spacy_nlp(text)
     # sentences
     sentences = []
     for span in document.sents:
@@ -66,6 +67,36 @@ def get_sentences_and_tokens_from_stanford(text, core_nlp):
         sentences.append(tokens)
     return sentences
 
+def load_tokenizer(tokenizer, language):
+    '''
+    Return the spaCy model of language if tokenizer is 'spacy', or the client of the Stanford CoreNLP server if tokenizer is 'stanford'.
+    '''
+    if tokenizer == 'spacy':
+        return spacy.load(language)
+    elif tokenizer == 'stanford':
+        return StanfordCoreNLP('http://localhost:{0}'.format(9000))
+    else:
+        raise ValueError("tokenizer should be either 'spacy' or 'stanford'.")
+
+def get_sentences_and_tokens(text, tokenizer, tokenizer_model):
+    '''
+    Split text into sentences of tokens with tokenizer_model, as returned by load_tokenizer(tokenizer, language).
+    '''
+    if tokenizer == 'spacy':
+        return get_sentences_and_tokens_from_spacy(text, tokenizer_model)
+    elif tokenizer == 'stanford':
+        return get_sentences_and_tokens_from_stanford(text, tokenizer_model)
+    else:
+        raise ValueError("tokenizer should be either 'spacy' or 'stanford'.")
+
+def get_sentences_and_tokens_of_texts(texts, tokenizer, tokenizer_model):
+    '''
+    Same as get_sentences_and_tokens for each text of texts. With spaCy, the texts are processed together, which is faster.
+    '''
+    if tokenizer == 'spacy':
+        return [get_sentences_and_tokens_from_spacy(text, tokenizer_model, document=document) for text, document in zip(texts, tokenizer_model.pipe(texts))]
+    return [get_sentences_and_tokens(text, tokenizer, tokenizer_model) for text in texts]
+
 def get_entities_from_brat(text_filepath, annotation_filepath, verbose=False):
     # load text
     with codecs.open(text_filepath, 'r', 'UTF-8') as f:
@@ -116,17 +147,14 @@ def check_brat_annotation_and_text_compatibility(brat_folder):
         text, entities = get_entities_from_brat(text_filepath, annotation_filepath)
     print("Done.")
 
-def brat_to_conll(input_folder, output_filepath, tokenizer, language):
+def brat_to_conll(input_folder, output_filepath, tokenizer, language, tokenizer_model=None):
     '''
     Assumes '.txt' and '.ann' files are in the input_folder.
     Checks for the compatibility between .txt and .ann at the same time.
+    tokenizer_model is the tokenizer returned by load_tokenizer(tokenizer, language). If it is not given, it is loaded for this call only.
     '''
-    if tokenizer == 'spacy':
-        spacy_nlp = spacy.load(language)
-    elif tokenizer == 'stanford':
-        core_nlp = StanfordCoreNLP('http://localhost:{0}'.format(9000))
-    else:
-        raise ValueError("tokenizer should be either 'spacy' or 'stanford'.")
+    if tokenizer_model is None:
+        tokenizer_model = load_tokenizer(tokenizer, language)
     verbose = False
     dataset_type =  os.path.basename(input_folder)
     print("Formatting {0} set from BRAT to CONLL... ".format(dataset_type), end='')
@@ -142,10 +170,7 @@ def brat_to_conll(input_folder, output_filepath, tokenizer, language):
         text, entities = get_entities_from_brat(text_filepath, annotation_filepath)
         entities = sorted(entities, key=lambda entity:entity["start"])
         
-        if tokenizer == 'spacy':
-            sentences = get_sentences_and_tokens_from_spacy(text, spacy_nlp)
-        elif tokenizer == 'stanford':
-            sentences = get_sentences_and_tokens_from_stanford(text, core_nlp)
+        sentences = get_sentences_and_tokens(text, tokenizer, tokenizer_model)
         
         for sentence in sentences:
             inside = False
@@ -183,7 +208,3 @@ def brat_to_conll(input_folder, output_filepath, tokenizer, language):
 
     output_file.close()
     print('Done.')
-    if tokenizer == 'spacy':
-        del spacy_nlp
-    elif tokenizer == 'stanford':
-        del core_nlp
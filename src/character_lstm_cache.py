@@ -0,0 +1,79 @@
+'''
+Cache of the character LSTM outputs, used to skip the character LSTM at inference
+'''
+import collections
+import random
+import numpy as np
+
+
+class CharacterLSTMCache(object):
+    """
+    At inference, the output of the character LSTM for a token depends only on the characters of the token.
+
+    The outputs for all the tokens of the vocabulary are computed once, and stored in a [vocabulary_size, 2 * character_lstm_hidden_state_dimension] table.
+    The outputs for the tokens that are not in the vocabulary (i.e. mapped to UNK) are computed on demand, and memoized in a
+    least recently used cache of at most cache_size tokens.
+
+    get_character_lstm_output() returns the character LSTM outputs of a batch, to be fed to model.character_lstm_output.
+    The cache must be rebuilt whenever the weights of the model change.
+    """
+    def __init__(self, sess, model, dataset, cache_size=10000, number_of_tokens_per_run=1000):
+        self.model = model
+        self.dataset = dataset
+        self.cache_size = cache_size
+        self.number_of_tokens_per_run = number_of_tokens_per_run
+        vocabulary = [dataset.index_to_token[token_index] for token_index in range(dataset.vocabulary_size)]
+        self.vocabulary_outputs = self._compute_character_lstm_outputs(sess, vocabulary)
+        self.unknown_token_outputs = collections.OrderedDict()
+        self.number_of_hits = 0
+        self.number_of_misses = 0
+
+    def _get_character_indices(self, token):
+        # Characters that are not in the alphabet are mapped to a random character, as in Dataset
+        return [self.dataset.character_to_index.get(character, random.randint(1, max(self.dataset.index_to_character.keys()))) for character in token]
+
+    def _compute_character_lstm_outputs(self, sess, tokens):
+        '''
+        Run the character LSTM on the tokens, number_of_tokens_per_run tokens at a time.
+        '''
+        character_lstm_outputs = []
+        for start in range(0, len(tokens), self.number_of_tokens_per_run):
+            character_indices = [self._get_character_indices(token) for token in tokens[start:start + self.number_of_tokens_per_run]]
+            token_lengths = np.array([len(token_character_indices) for token_character_indices in character_indices], dtype=np.int32)
+            padded_character_indices = np.full([len(character_indices), max(1, token_lengths.max())], self.dataset.PADDING_CHARACTER_INDEX, dtype=np.int32)
+            for i, token_character_indices in enumerate(character_indices):
+                padded_character_indices[i, :len(token_character_indices)] = token_character_indices
+            feed_dict = {self.model.input_token_character_indices: padded_character_indices,
+                         self.model.input_token_lengths: token_lengths}
+            character_lstm_outputs.append(sess.run(self.model.token_character_lstm_output, feed_dict))
+        return np.concatenate(character_lstm_outputs, axis=0)
+
+    def get_character_lstm_output(self, sess, dataset_type, sequence_numbers):
+        '''
+        Return the character LSTM outputs of the batch of sequences of dataset_type, padded to [batch_size, max_sequence_length, 2 * character_lstm_hidden_state_dimension].
+        '''
+        token_indices = self.dataset.token_indices[dataset_type]
+        tokens = self.dataset.tokens[dataset_type]
+        max_sequence_length = max(len(token_indices[sequence_number]) for sequence_number in sequence_numbers)
+        character_lstm_output = np.zeros([len(sequence_numbers), max_sequence_length, self.vocabulary_outputs.shape[1]], dtype=np.float32)
+        missing_token_positions = collections.OrderedDict()
+        for i, sequence_number in enumerate(sequence_numbers):
+            for j, (token_index, token) in enumerate(zip(token_indices[sequence_number], tokens[sequence_number])):
+                if token_index != self.dataset.UNK_TOKEN_INDEX:
+                    character_lstm_output[i, j] = self.vocabulary_outputs[token_index]
+                elif token in self.unknown_token_outputs:
+                    self.unknown_token_outputs.move_to_end(token)
+                    character_lstm_output[i, j] = self.unknown_token_outputs[token]
+                    self.number_of_hits += 1
+                else:
+                    missing_token_positions.setdefault(token, []).append((i, j))
+        if len(missing_token_positions) > 0:
+            self.number_of_misses += len(missing_token_positions)
+            missing_tokens = list(missing_token_positions.keys())
+            for token, token_output in zip(missing_tokens, self._compute_character_lstm_outputs(sess, missing_tokens)):
+                for i, j in missing_token_positions[token]:
+                    character_lstm_output[i, j] = token_output
+                self.unknown_token_outputs[token] = token_output
+                if len(self.unknown_token_outputs) > self.cache_size:
+                    self.unknown_token_outputs.popitem(last=False)
+        return character_lstm_output
@@ -0,0 +1,102 @@
+'''
+Write the checkpoints of the model in a background thread, and keep only the best ones
+'''
+import glob
+import os
+import pickle
+import threading
+import tensorflow as tf
+
+
+class CheckpointWriter(object):
+    """
+    Save the checkpoints without blocking the training.
+
+    save() copies the variables into in-memory snapshot variables, and a background thread writes the snapshot to disk
+    while the training goes on. The snapshot is saved under the names of the original variables, so the checkpoints can be
+    restored by model.saver as usual.
+
+    After each checkpoint, only the number_of_checkpoints_to_keep checkpoints with the best validation F1-score and the latest
+    checkpoint are kept on disk (all of them if number_of_checkpoints_to_keep is 0).
+
+    The state of the training loop given to save() is written to training_state.pickle along with each checkpoint,
+    so that the training can be resumed from the latest checkpoint (see load_training_state).
+    """
+    def __init__(self, model_folder, number_of_checkpoints_to_keep, var_list=None):
+        self.model_folder = model_folder
+        self.number_of_checkpoints_to_keep = number_of_checkpoints_to_keep
+        if var_list is None:
+            var_list = tf.global_variables()
+        snapshot_variables = {}
+        snapshot_ops = []
+        with tf.variable_scope('checkpoint_snapshot'):
+            for var in var_list:
+                with tf.colocate_with(var):
+                    # Local variables are not saved by the savers of the model
+                    snapshot_variable = tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype), trainable=False,
+                                                    collections=[tf.GraphKeys.LOCAL_VARIABLES], name=var.op.name)
+                    snapshot_ops.append(tf.assign(snapshot_variable, var, validate_shape=False))
+                snapshot_variables[var.op.name] = snapshot_variable
+        self.snapshot_op = tf.group(*snapshot_ops)
+        # The retention policy is applied by the writer, so the saver itself does not delete any checkpoint
+        self.saver = tf.train.Saver(var_list=snapshot_variables, max_to_keep=0)
+        self.checkpoints = [] # list of (valid F1-score, epoch number, checkpoint path)
+        self.thread = None
+        self.exception = None
+
+    def save(self, sess, epoch_number, valid_f1_score, training_state=None):
+        '''
+        Take a snapshot of the variables and write it in the background as model_{epoch_number}.ckpt.
+        training_state must not be modified afterwards (pass a copy).
+        '''
+        # Wait for the previous checkpoint, since the snapshot variables are reused
+        self.wait()
+        sess.run(self.snapshot_op)
+        checkpoint_path = os.path.join(self.model_folder, 'model_{0:05d}.ckpt'.format(epoch_number))
+        self.thread = threading.Thread(target=self._write, args=(sess, checkpoint_path, epoch_number, valid_f1_score, training_state))
+        self.thread.start()
+
+    def _write(self, sess, checkpoint_path, epoch_number, valid_f1_score, training_state):
+        try:
+            self.saver.save(sess, checkpoint_path)
+            self.checkpoints.append((valid_f1_score, epoch_number, checkpoint_path))
+            if training_state is not None:
+                # The training state is written before the older checkpoints are deleted, so that it always refers to an existing checkpoint
+                training_state['checkpoint_path'] = checkpoint_path
+                training_state['checkpoints'] = list(self.checkpoints)
+                training_state_filepath = os.path.join(self.model_folder, 'training_state.pickle')
+                with open(training_state_filepath + '.tmp', 'wb') as f:
+                    pickle.dump(training_state, f)
+                os.replace(training_state_filepath + '.tmp', training_state_filepath)
+            if self.number_of_checkpoints_to_keep > 0:
+                # In case of tie, the earliest checkpoint is the best one
+                best_checkpoints = sorted(self.checkpoints, key=lambda checkpoint: (-checkpoint[0], checkpoint[1]))[:self.number_of_checkpoints_to_keep]
+                for checkpoint in self.checkpoints:
+                    if checkpoint not in best_checkpoints and checkpoint[2] != checkpoint_path:
+                        for filepath in glob.glob('{0}.*'.format(checkpoint[2])):
+                            os.remove(filepath)
+                self.checkpoints = [checkpoint for checkpoint in self.checkpoints if checkpoint in best_checkpoints or checkpoint[2] == checkpoint_path]
+            tf.train.update_checkpoint_state(self.model_folder, checkpoint_path,
+                                             all_model_checkpoint_paths=[checkpoint[2] for checkpoint in self.checkpoints])
+        except Exception as e:
+            self.exception = e
+
+    def wait(self):
+        '''
+        Wait until the last checkpoint is written.
+        '''
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.exception is not None:
+            exception = self.exception
+            self.exception = None
+            raise exception
+
+
+def load_training_state(model_folder):
+    '''
+    Load the state of the training loop saved along with the latest checkpoint of model_folder.
+    '''
+    with open(os.path.join(model_folder, 'training_state.pickle'), 'rb') as f:
+        return pickle.load(f)
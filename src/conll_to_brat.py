@@ -237,6 +237,54 @@ def conll_to_brat(conll_input_filepath, conll_output_filepath, brat_original_fol
     conll_file.close()
     print('Done.')
 
+def write_brat_annotation(annotation_filepath, entities):
+    '''
+    Write the entities, in the format returned by brat_to_conll.get_entities_from_brat, to the brat annotation file annotation_filepath.
+    '''
+    with codecs.open(annotation_filepath, 'w', 'utf-8') as output_file:
+        for entity in entities:
+            output_file.write('{0}\t{1} {2} {3}\t{4}\n'.format(entity['id'], entity['type'], entity['start'], entity['end'], entity['text']))
+
+def get_entities_from_bio_labels(text, sentences, labels):
+    '''
+    Build the entities of text from the BIO labels of its tokens, in the same way as conll_to_brat does from a conll file,
+    and return them in the same format as brat_to_conll.get_entities_from_brat (with ids T1, T2, ...).
+
+    sentences: list of sentences, each a list of tokens with their text, start and end offsets (see brat_to_conll.get_sentences_and_tokens_from_spacy)
+    labels: list of the BIO labels of the tokens of each sentence
+    '''
+    entities = []
+    for sentence, sentence_labels in zip(sentences, labels):
+        # The entities do not span several sentences
+        entity = None
+        previous_token_label = 'O'
+        for token, label in zip(sentence, sentence_labels):
+            label = label.replace('_', '-') # For LOCATION-OTHER
+            if label == 'O':
+                # Previous entity ended
+                if entity is not None:
+                    entities.append(entity)
+                    entity = None
+                previous_token_label = 'O'
+                continue
+            token_label = label[2:]
+            if label[:2] == 'I-' and previous_token_label == token_label and '\n' not in text[entity['end']:token['start']]:
+                # Entity continued
+                entity['end'] = token['end']
+            else:
+                # End the previous entity (if any) and start a new one
+                if entity is not None:
+                    entities.append(entity)
+                entity = {'type': token_label, 'start': token['start'], 'end': token['end']}
+            previous_token_label = token_label
+        if entity is not None:
+            entities.append(entity)
+    for i, entity in enumerate(entities):
+        entity['id'] = 'T{0}'.format(i + 1)
+        # Same text as in the annotation file read by get_entities_from_brat
+        entity['text'] = utils_nlp.replace_unicode_whitespaces_with_ascii_whitespace(text[entity['start']:entity['end']])
+    return entities
+
 def output_brat(output_filepaths, dataset_brat_folders, stats_graph_folder, overwrite=False):
     # Output brat files
     for dataset_type in ['train', 'valid', 'test', 'deploy']:
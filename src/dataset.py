@@ -129,7 +129,19 @@ class Dataset(object):
         '''
         for dataset_type in dataset_types:
             self.labels[dataset_type], self.tokens[dataset_type], _, _, _ = self._parse_dataset(dataset_filepaths.get(dataset_type, None))
-        
+        self._update_indices(dataset_types)
+
+    def update_dataset_from_tokens(self, token_sequences, dataset_type='deploy'):
+        '''
+        token_sequences : list of sequences of tokens (e.g. the sentences of a text to predict)
+        Overwrites the data of dataset_type with token_sequences, labeled 'O', using the existing token_to_index, character_to_index, and label_to_index mappings.
+        Unlike update_dataset, no file is read.
+        '''
+        self.tokens[dataset_type] = [list(token_sequence) for token_sequence in token_sequences]
+        self.labels[dataset_type] = [['O'] * len(token_sequence) for token_sequence in token_sequences]
+        self._update_indices([dataset_type])
+
+    def _update_indices(self, dataset_types):
         token_indices, label_indices, character_indices_padded, character_indices, token_lengths, characters, label_vector_indices = self._convert_to_indices(dataset_types)
         
         self.token_indices.update(token_indices)
@@ -0,0 +1,169 @@
+'''
+Synchronous data-parallel training with several worker processes on localhost
+'''
+import multiprocessing
+import socket
+import tensorflow as tf
+from entity_lstm import EntityLSTM
+from input_pipeline import InputPipeline
+import train
+
+
+def get_free_ports(number_of_ports):
+    '''
+    Ask the OS for number_of_ports distinct free TCP ports on localhost.
+    '''
+    sockets = []
+    for _ in range(number_of_ports):
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.bind(('localhost', 0))
+        sockets.append(s)
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+def get_session_config(parameters):
+    return tf.ConfigProto(
+        intra_op_parallelism_threads=parameters['number_of_cpu_threads'],
+        inter_op_parallelism_threads=parameters['number_of_cpu_threads'],
+        device_count={'CPU': 1, 'GPU': parameters['number_of_gpus']},
+        allow_soft_placement=True,
+        log_device_placement=False
+        )
+
+
+def get_device_setter(cluster_spec, task_index):
+    '''
+    Place the variables on the parameter server, and the other operations on the worker task_index.
+    '''
+    return tf.train.replica_device_setter(worker_device='/job:worker/task:{0}'.format(task_index), cluster=tf.train.ClusterSpec(cluster_spec))
+
+
+def synchronize_step(step_barrier, stop_training, stop=None):
+    '''
+    Wait until every process is ready to run the next training step, and return whether the training of the epoch must stop.
+    Only the chief decides to stop (stop is None in the other workers): it writes its decision before reaching the barrier,
+    and the other workers read it after the barrier, so that all the processes run the same number of steps.
+    '''
+    if stop is not None:
+        stop_training.value = stop
+    step_barrier.wait()
+    return bool(stop_training.value)
+
+
+def run_worker(cluster_spec, task_index, dataset, parameters, batch_queue, done_queue, step_barrier, stop_training, chief_ready):
+    '''
+    Main function of the worker processes (all the workers except the chief, which runs in the NeuroNER process).
+    The worker waits for chief_ready to be set, then trains on each shard of batches it receives from batch_queue, until it receives None.
+    '''
+    try:
+        session_config = get_session_config(parameters)
+        server = tf.train.Server(tf.train.ClusterSpec(cluster_spec), job_name='worker', task_index=task_index, config=session_config)
+        with tf.device(get_device_setter(cluster_spec, task_index)):
+            if parameters['input_pipeline'] == 'tf_data':
+                input_pipeline = InputPipeline(dataset, parameters)
+                model = EntityLSTM(dataset, parameters, input_batch=input_pipeline.next_batch)
+            else:
+                input_pipeline = None
+                model = EntityLSTM(dataset, parameters)
+        sess = tf.Session(server.target, config=session_config)
+
+        # Wait for the chief to initialize, restore and load all the shared variables, including the local ones placed on the parameter server
+        # (e.g. the mask of infrequent tokens), which ready_for_local_init_op does not check
+        chief_ready.wait()
+        sess.run(model.sync_optimizer.local_step_init_op)
+
+        while True:
+            batches = batch_queue.get()
+            if batches is None:
+                break
+            if input_pipeline is not None:
+                input_pipeline.initialize(sess, 'train', batches)
+            for sequence_numbers in batches:
+                if synchronize_step(step_barrier, stop_training):
+                    break
+                train.train_step(sess, dataset, sequence_numbers, model, parameters, input_pipeline=input_pipeline)
+            done_queue.put(task_index)
+        sess.close()
+    except KeyboardInterrupt:
+        pass
+
+
+class LocalCluster(object):
+    """
+    Cluster made of one parameter server and number_of_workers workers, all running on localhost.
+
+    The parameter server and the chief worker (task 0) run in the current process, and the other workers in child processes.
+    Each worker computes the gradients on its own shard of the batches of the epoch, and the SyncReplicasOptimizer of
+    EntityLSTM averages the gradients of the number_of_workers workers before applying them to the shared variables.
+    """
+    def __init__(self, dataset, parameters):
+        self.number_of_workers = parameters['number_of_workers']
+        ports = get_free_ports(self.number_of_workers + 1)
+        self.cluster_spec = {'ps': ['localhost:{0}'.format(ports[0])],
+                             'worker': ['localhost:{0}'.format(port) for port in ports[1:]]}
+        cluster = tf.train.ClusterSpec(self.cluster_spec)
+        session_config = get_session_config(parameters)
+        self.parameter_server = tf.train.Server(cluster, job_name='ps', task_index=0, config=session_config)
+        self.server = tf.train.Server(cluster, job_name='worker', task_index=0, config=session_config)
+        self.target = self.server.target
+        self.device_setter = get_device_setter(self.cluster_spec, 0)
+
+        # The workers are spawned rather than forked, since TensorFlow is not fork-safe
+        context = multiprocessing.get_context('spawn')
+        self.step_barrier = context.Barrier(self.number_of_workers)
+        self.stop_training = context.Value('b', False)
+        self.done_queue = context.Queue()
+        self.chief_ready = context.Event()
+        self.batch_queues = []
+        self.workers = []
+        for task_index in range(1, self.number_of_workers):
+            batch_queue = context.Queue()
+            worker = context.Process(target=run_worker, args=(self.cluster_spec, task_index, dataset, parameters, batch_queue, self.done_queue,
+                                                              self.step_barrier, self.stop_training, self.chief_ready))
+            worker.daemon = True
+            worker.start()
+            self.batch_queues.append(batch_queue)
+            self.workers.append(worker)
+        self.queue_runner_coordinator = None
+
+    def start(self, sess, model):
+        '''
+        Start the chief once the shared variables are initialized, restored and loaded: this lets the other workers start.
+        '''
+        sess.run(model.sync_optimizer.chief_init_op)
+        self.queue_runner_coordinator = tf.train.Coordinator()
+        model.sync_optimizer.get_chief_queue_runner().create_threads(sess, coord=self.queue_runner_coordinator, daemon=True, start=True)
+        self.chief_ready.set()
+
+    def distribute_batches(self, batches):
+        '''
+        Split the batches of the epoch into number_of_workers shards with the same number of batches, since each synchronous step
+        needs one gradient from every worker. The remaining len(batches) % number_of_workers batches are left out of the epoch.
+        Send the shards to the workers and return them: the chief trains on the first one.
+        '''
+        number_of_batches_per_worker = len(batches) // self.number_of_workers
+        shards = [batches[task_index*number_of_batches_per_worker:(task_index+1)*number_of_batches_per_worker]
+                  for task_index in range(self.number_of_workers)]
+        for batch_queue, shard in zip(self.batch_queues, shards[1:]):
+            batch_queue.put(shard)
+        return shards
+
+    def synchronize_step(self, stop):
+        return synchronize_step(self.step_barrier, self.stop_training, stop=stop)
+
+    def wait_for_workers(self):
+        for _ in self.workers:
+            self.done_queue.get()
+
+    def stop(self):
+        for batch_queue in self.batch_queues:
+            batch_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+        if self.queue_runner_coordinator is not None:
+            self.queue_runner_coordinator.request_stop()
@@ -5,9 +5,13 @@ import utils_tf
 import utils_nlp
 import os
 import pickle
+import numpy as np
 
-def bidirectional_LSTM(input, hidden_state_dimension, initializer, sequence_length=None, output_sequence=True):
-
+def bidirectional_LSTM(input, hidden_state_dimension, initializer, sequence_length=None, output_sequence=True, cell_type='cifg'):
+    '''
+    cell_type is either 'cifg' (tf.contrib.rnn.CoupledInputForgetGateLSTMCell run by tf.nn.bidirectional_dynamic_rnn)
+    or 'fused' (tf.contrib.rnn.LSTMBlockFusedCell, which runs the whole sequence in a single op).
+    '''
     with tf.variable_scope("bidirectional_LSTM"):
         if sequence_length == None:
             batch_size = 1
@@ -18,25 +22,44 @@ def bidirectional_LSTM(input, hidden_state_dimension, initializer, sequence_leng
 
         lstm_cell = {}
         initial_state = {}
+        outputs = {}
+        final_states = {}
+        if cell_type == 'fused':
+            # The fused cell expects time-major inputs
+            time_major_input = tf.transpose(input, [1, 0, 2])
         for direction in ["forward", "backward"]:
-            with tf.variable_scope(direction):
+            with tf.variable_scope(direction, initializer=initializer):
                 # LSTM cell
-                lstm_cell[direction] = tf.contrib.rnn.CoupledInputForgetGateLSTMCell(hidden_state_dimension, forget_bias=1.0, initializer=initializer, state_is_tuple=True)
+                if cell_type == 'fused':
+                    lstm_cell[direction] = tf.contrib.rnn.LSTMBlockFusedCell(hidden_state_dimension, forget_bias=1.0)
+                    if direction == "backward":
+                        lstm_cell[direction] = tf.contrib.rnn.TimeReversedFusedRNN(lstm_cell[direction])
+                else:
+                    lstm_cell[direction] = tf.contrib.rnn.CoupledInputForgetGateLSTMCell(hidden_state_dimension, forget_bias=1.0, initializer=initializer, state_is_tuple=True)
                 # initial state: http://stackoverflow.com/questions/38441589/tensorflow-rnn-initial-state
                 initial_cell_state = tf.get_variable("initial_cell_state", shape=[1, hidden_state_dimension], dtype=tf.float32, initializer=initializer)
                 initial_output_state = tf.get_variable("initial_output_state", shape=[1, hidden_state_dimension], dtype=tf.float32, initializer=initializer)
                 c_states = tf.tile(initial_cell_state, tf.stack([batch_size, 1]))
                 h_states = tf.tile(initial_output_state, tf.stack([batch_size, 1]))
                 initial_state[direction] = tf.contrib.rnn.LSTMStateTuple(c_states, h_states)
-
-        # sequence_length must be provided for tf.nn.bidirectional_dynamic_rnn due to internal bug
-        outputs, final_states = tf.nn.bidirectional_dynamic_rnn(lstm_cell["forward"],
-                                                                    lstm_cell["backward"],
-                                                                    input,
-                                                                    dtype=tf.float32,
-                                                                    sequence_length=sequence_length,
-                                                                    initial_state_fw=initial_state["forward"],
-                                                                    initial_state_bw=initial_state["backward"])
+                if cell_type == 'fused':
+                    # The variables of the fused cell are created in the scope of the direction when the cell is called
+                    time_major_output, final_states[direction] = lstm_cell[direction](time_major_input, initial_state=initial_state[direction], dtype=tf.float32,
+                                                                                       sequence_length=sequence_length)
+                    outputs[direction] = tf.transpose(time_major_output, [1, 0, 2])
+
+        if cell_type == 'fused':
+            outputs = (outputs["forward"], outputs["backward"])
+            final_states = (final_states["forward"], final_states["backward"])
+        else:
+            # sequence_length must be provided for tf.nn.bidirectional_dynamic_rnn due to internal bug
+            outputs, final_states = tf.nn.bidirectional_dynamic_rnn(lstm_cell["forward"],
+                                                                        lstm_cell["backward"],
+                                                                        input,
+                                                                        dtype=tf.float32,
+                                                                        sequence_length=sequence_length,
+                                                                        initial_state_fw=initial_state["forward"],
+                                                                        initial_state_bw=initial_state["backward"])
         if output_sequence == True:
             outputs_forward, outputs_backward = outputs
             output = tf.concat([outputs_forward, outputs_backward], axis=2, name='output_sequence')
@@ -52,30 +75,84 @@ def bidirectional_LSTM(input, hidden_state_dimension, initializer, sequence_leng
     return output
 
 
+def character_CNN(input, sequence_length, filter_widths, number_of_filters, initializer):
+    '''
+    Encode each token with parallel convolutions of the given widths over its characters, followed by a max pooling over the characters.
+    input is [number_of_tokens, max_token_length, character_embedding_dimension], and the output is [number_of_tokens, len(filter_widths) * number_of_filters].
+    Unlike the character LSTM, all the characters of a token are processed in parallel.
+    '''
+    character_embedding_dimension = input.get_shape().as_list()[2]
+    # The padding characters are excluded from the max pooling
+    mask = tf.expand_dims(tf.sequence_mask(sequence_length, tf.shape(input)[1], dtype=tf.float32), axis=2)
+    outputs = []
+    for filter_width in filter_widths:
+        with tf.variable_scope("convolution_width_{0}".format(filter_width)):
+            W = tf.get_variable("W", shape=[filter_width, character_embedding_dimension, number_of_filters], initializer=initializer)
+            b = tf.get_variable("bias", shape=[number_of_filters], initializer=tf.zeros_initializer())
+            convolution = tf.nn.tanh(tf.nn.conv1d(input, W, stride=1, padding='SAME') + b)
+            outputs.append(tf.reduce_max(convolution * mask + (mask - 1.) * 2., axis=1))
+    return tf.concat(outputs, axis=1, name='output')
+
+
+def clip_gradient_by_value(gradient, clipping_value):
+    '''
+    Clip the gradient between -clipping_value and clipping_value.
+    The gradients of the embedding lookups (IndexedSlices) stay sparse: the slices of the same row are summed, then clipped,
+    which gives the same result as clipping the dense gradient on the rows of the batch.
+    '''
+    if gradient is None:
+        return None
+    if isinstance(gradient, tf.IndexedSlices):
+        unique_indices, positions = tf.unique(gradient.indices)
+        values = tf.unsorted_segment_sum(gradient.values, positions, tf.shape(unique_indices)[0])
+        return tf.IndexedSlices(tf.clip_by_value(values, -clipping_value, clipping_value), unique_indices, gradient.dense_shape)
+    return tf.clip_by_value(gradient, -clipping_value, clipping_value)
+
+
 class EntityLSTM(object):
     """
     An LSTM architecture for named entity recognition.
     Uses a character embedding layer followed by an LSTM to generate vector representation from characters for each token.
     Then the character vector is concatenated with token embedding vector, which is input to another LSTM  followed by a CRF layer.
     """
-    def __init__(self, dataset, parameters):
+    def __init__(self, dataset, parameters, input_batch=None, inference_only=False):
+        '''
+        If inference_only is True, only the forward pass is built: the loss, the training procedure, the word dropout and the TensorBoard summaries
+        are skipped, so the model has neither the global step nor the optimizer slots, and the saver only restores the variables of the forward pass.
+        '''
 
         self.verbose = False
+        self.inference_only = inference_only
 
         # Placeholders for input, output and dropout
-        self.input_token_indices = tf.placeholder(tf.int32, [None], name="input_token_indices")
-        self.input_label_indices_vector = tf.placeholder(tf.float32, [None, dataset.number_of_classes], name="input_label_indices_vector")
-        self.input_label_indices_flat = tf.placeholder(tf.int32, [None], name="input_label_indices_flat")
-        self.input_token_character_indices = tf.placeholder(tf.int32, [None, None], name="input_token_indices")
-        self.input_token_lengths = tf.placeholder(tf.int32, [None], name="input_token_lengths")
+        # Sentences are fed in batches, padded to [batch_size, max_sequence_length]
+        # If input_batch is given (tf.data input pipeline), the placeholders default to its tensors, so that they only need to be fed when debugging.
+        def input_placeholder(key, dtype, shape, name):
+            if input_batch is None:
+                return tf.placeholder(dtype, shape, name=name)
+            return tf.placeholder_with_default(input_batch[key], shape, name=name)
+        self.input_token_indices = input_placeholder('token_indices', tf.int32, [None, None], "input_token_indices")
+        self.input_label_indices_vector = input_placeholder('label_vector_indices', tf.float32, [None, None, dataset.number_of_classes], "input_label_indices_vector")
+        self.input_label_indices_flat = input_placeholder('label_indices', tf.int32, [None, None], "input_label_indices_flat")
+        # The characters are given for the distinct tokens of the batch only, padded to [number_of_unique_tokens, max_token_length],
+        # and input_token_unique_indices maps each token of the batch to its unique token (see train.get_batch)
+        self.input_token_character_indices = input_placeholder('character_indices', tf.int32, [None, None], "input_token_character_indices")
+        self.input_token_lengths = input_placeholder('token_lengths', tf.int32, [None], "input_token_lengths")
+        self.input_token_unique_indices = input_placeholder('token_unique_indices', tf.int32, [None, None], "input_token_unique_indices")
+        self.input_sequence_lengths = input_placeholder('sequence_lengths', tf.int32, [None], "input_sequence_lengths")
         self.dropout_keep_prob = tf.placeholder(tf.float32, name="dropout_keep_prob")
 
+        batch_size = tf.shape(self.input_token_indices)[0]
+        max_sequence_length = tf.shape(self.input_token_indices)[1]
+        sequence_mask = tf.sequence_mask(self.input_sequence_lengths, max_sequence_length, dtype=tf.float32, name='sequence_mask')
+
         # Internal parameters
         initializer = tf.contrib.layers.xavier_initializer()
 
         if parameters['use_character_lstm']:
             # Character-level LSTM
-            # Idea: reshape so that we have a tensor [number_of_token, max_token_length, token_embeddings_size], which we pass to the LSTM
+            # Idea: the LSTM runs on a tensor [number_of_unique_tokens, max_token_length, character_embedding_dimension], and its outputs are
+            # gathered back to [batch_size, max_sequence_length, 2 * character_lstm_hidden_state_dimension]
 
             # Character embedding layer
             with tf.variable_scope("character_embedding"):
@@ -85,14 +162,48 @@ class EntityLSTM(object):
                     initializer=initializer)
                 embedded_characters = tf.nn.embedding_lookup(self.character_embedding_weights, self.input_token_character_indices, name='embedded_characters')
                 if self.verbose: print("embedded_characters: {0}".format(embedded_characters))
-                utils_tf.variable_summaries(self.character_embedding_weights)
-
-            # Character LSTM layer
-            with tf.variable_scope('character_lstm') as vs:
-                character_lstm_output = bidirectional_LSTM(embedded_characters, parameters['character_lstm_hidden_state_dimension'], initializer,
-                                                           sequence_length=self.input_token_lengths, output_sequence=False)
-                self.character_lstm_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=vs.name)
-
+                self.variable_summaries(self.character_embedding_weights)
+
+            # Character LSTM layer (or character CNN layer if character_encoder is 'cnn')
+            # The variables of the character encoder are reloaded from a pretrained model according to reload_character_lstm, whatever the encoder
+            if parameters['character_encoder'] == 'cnn':
+                filter_widths = [int(filter_width) for filter_width in str(parameters['character_cnn_filter_widths']).split()]
+                character_output_dimension = len(filter_widths) * parameters['character_cnn_number_of_filters']
+                with tf.variable_scope('character_cnn') as vs:
+                    character_lstm_output = character_CNN(embedded_characters, self.input_token_lengths, filter_widths,
+                                                          parameters['character_cnn_number_of_filters'], initializer)
+                    self.character_lstm_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=vs.name)
+            else:
+                character_output_dimension = 2 * parameters['character_lstm_hidden_state_dimension']
+                with tf.variable_scope('character_lstm') as vs:
+                    character_lstm_output = bidirectional_LSTM(embedded_characters, parameters['character_lstm_hidden_state_dimension'], initializer,
+                                                               sequence_length=self.input_token_lengths, output_sequence=False, cell_type=parameters['lstm_cell_type'])
+                    self.character_lstm_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=vs.name)
+
+            # [number_of_unique_tokens, character_output_dimension], used by CharacterLSTMCache to compute the outputs of given tokens
+            self.token_character_lstm_output = character_lstm_output
+            # The gradients of the repeated tokens are summed by the gather
+            character_lstm_output = tf.gather(character_lstm_output, self.input_token_unique_indices, name='character_lstm_output_per_token')
+            # At inference, the outputs can be fed from a CharacterLSTMCache instead, which skips the character LSTM
+            character_lstm_output = tf.placeholder_with_default(character_lstm_output, [None, None, character_output_dimension], name='character_lstm_output')
+            self.character_lstm_output = character_lstm_output
+
+
+        # Replace infrequent tokens with UNK with probability word_dropout_probability (only fed when training)
+        # The mask of infrequent tokens is a local variable: it is not saved in the checkpoints, and is loaded with load_infrequent_token_mask.
+        if inference_only:
+            self.word_dropout_probability = None
+            self.infrequent_token_mask = None
+            token_indices = self.input_token_indices
+        else:
+            with tf.variable_scope("word_dropout"):
+                self.word_dropout_probability = tf.placeholder_with_default(0.0, [], name='word_dropout_probability')
+                self.infrequent_token_mask = tf.get_variable("infrequent_token_mask", shape=[dataset.vocabulary_size], dtype=tf.bool,
+                                                             initializer=tf.zeros_initializer(), trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES])
+                is_dropped = tf.logical_and(tf.gather(self.infrequent_token_mask, self.input_token_indices),
+                                            tf.random_uniform(tf.shape(self.input_token_indices)) < self.word_dropout_probability)
+                token_indices = tf.where(is_dropped, tf.fill(tf.shape(self.input_token_indices), dataset.UNK_TOKEN_INDEX), self.input_token_indices,
+                                         name='token_indices')
 
         # Token embedding layer
         with tf.variable_scope("token_embedding"):
@@ -101,14 +212,14 @@ class EntityLSTM(object):
                 shape=[dataset.vocabulary_size, parameters['token_embedding_dimension']],
                 initializer=initializer,
                 trainable=not parameters['freeze_token_embeddings'])
-            embedded_tokens = tf.nn.embedding_lookup(self.token_embedding_weights, self.input_token_indices)
-            utils_tf.variable_summaries(self.token_embedding_weights)
+            embedded_tokens = tf.nn.embedding_lookup(self.token_embedding_weights, token_indices)
+            self.variable_summaries(self.token_embedding_weights)
 
         # Concatenate character LSTM outputs and token embeddings
         if parameters['use_character_lstm']:
             with tf.variable_scope("concatenate_token_and_character_vectors"):
                 if self.verbose: print('embedded_tokens: {0}'.format(embedded_tokens))
-                token_lstm_input = tf.concat([character_lstm_output, embedded_tokens], axis=1, name='token_lstm_input')
+                token_lstm_input = tf.concat([character_lstm_output, embedded_tokens], axis=2, name='token_lstm_input')
                 if self.verbose: print("token_lstm_input: {0}".format(token_lstm_input))
         else:
             token_lstm_input = embedded_tokens
@@ -117,17 +228,13 @@ class EntityLSTM(object):
         with tf.variable_scope("dropout"):
             token_lstm_input_drop = tf.nn.dropout(token_lstm_input, self.dropout_keep_prob, name='token_lstm_input_drop')
             if self.verbose: print("token_lstm_input_drop: {0}".format(token_lstm_input_drop))
-            # https://www.tensorflow.org/api_guides/python/contrib.rnn
-            # Prepare data shape to match `rnn` function requirements
-            # Current data input shape: (batch_size, n_steps, n_input)
-            # Required shape: 'n_steps' tensors list of shape (batch_size, n_input)
-            token_lstm_input_drop_expanded = tf.expand_dims(token_lstm_input_drop, axis=0, name='token_lstm_input_drop_expanded')
-            if self.verbose: print("token_lstm_input_drop_expanded: {0}".format(token_lstm_input_drop_expanded))
 
         # Token LSTM layer
         with tf.variable_scope('token_lstm') as vs:
-            token_lstm_output = bidirectional_LSTM(token_lstm_input_drop_expanded, parameters['token_lstm_hidden_state_dimension'], initializer, output_sequence=True)
-            token_lstm_output_squeezed = tf.squeeze(token_lstm_output, axis=0)
+            token_lstm_output = bidirectional_LSTM(token_lstm_input_drop, parameters['token_lstm_hidden_state_dimension'], initializer,
+                                                   sequence_length=self.input_sequence_lengths, output_sequence=True, cell_type=parameters['lstm_cell_type'])
+            # Flatten to [batch_size * max_sequence_length, 2 * token_lstm_hidden_state_dimension] for the feedforward layers
+            token_lstm_output_flat = tf.reshape(token_lstm_output, [-1, 2 * parameters['token_lstm_hidden_state_dimension']])
             self.token_lstm_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=vs.name)
 
         # Needed only if Bidirectional LSTM is used for token level
@@ -137,10 +244,10 @@ class EntityLSTM(object):
                 shape=[2 * parameters['token_lstm_hidden_state_dimension'], parameters['token_lstm_hidden_state_dimension']],
                 initializer=initializer)
             b = tf.Variable(tf.constant(0.0, shape=[parameters['token_lstm_hidden_state_dimension']]), name="bias")
-            outputs = tf.nn.xw_plus_b(token_lstm_output_squeezed, W, b, name="output_before_tanh")
+            outputs = tf.nn.xw_plus_b(token_lstm_output_flat, W, b, name="output_before_tanh")
             outputs = tf.nn.tanh(outputs, name="output_after_tanh")
-            utils_tf.variable_summaries(W)
-            utils_tf.variable_summaries(b)
+            self.variable_summaries(W)
+            self.variable_summaries(b)
             self.token_lstm_variables += tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=vs.name)
 
         with tf.variable_scope("feedforward_before_crf") as vs:
@@ -150,34 +257,38 @@ class EntityLSTM(object):
                 initializer=initializer)
             b = tf.Variable(tf.constant(0.0, shape=[dataset.number_of_classes]), name="bias")
             scores = tf.nn.xw_plus_b(outputs, W, b, name="scores")
-            self.unary_scores = scores
-            self.predictions = tf.argmax(self.unary_scores, 1, name="predictions")
-            utils_tf.variable_summaries(W)
-            utils_tf.variable_summaries(b)
+            self.unary_scores = tf.reshape(scores, [batch_size, max_sequence_length, dataset.number_of_classes], name='unary_scores')
+            self.predictions = tf.argmax(self.unary_scores, 2, name="predictions")
+            self.variable_summaries(W)
+            self.variable_summaries(b)
             self.feedforward_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=vs.name)
 
         # CRF layer
         if parameters['use_crf']:
             with tf.variable_scope("crf") as vs:
                 # Add start and end tokens
+                # The start token is at position 0 and the end token right after the last token of each sentence,
+                # so that each padded sentence is scored exactly as it would be on its own.
                 small_score = -1000.0
                 large_score = 0.0
-                sequence_length = tf.shape(self.unary_scores)[0]
-                unary_scores_with_start_and_end = tf.concat([self.unary_scores, tf.tile( tf.constant(small_score, shape=[1, 2]) , [sequence_length, 1])], 1)
-                start_unary_scores = [[small_score] * dataset.number_of_classes + [large_score, small_score]]
-                end_unary_scores = [[small_score] * dataset.number_of_classes + [small_score, large_score]]
-                self.unary_scores = tf.concat([start_unary_scores, unary_scores_with_start_and_end, end_unary_scores], 0)
+                unary_scores_with_start_and_end = tf.concat([self.unary_scores, tf.fill([batch_size, max_sequence_length, 2], small_score)], 2)
+                start_unary_scores = tf.tile(tf.constant([[[small_score] * dataset.number_of_classes + [large_score, small_score]]]), [batch_size, 1, 1])
+                end_unary_scores = tf.constant([small_score] * dataset.number_of_classes + [small_score, large_score])
+                padding_unary_scores = tf.fill([batch_size, 1, dataset.number_of_classes + 2], small_score)
+                unary_scores_with_start_and_end = tf.concat([start_unary_scores, unary_scores_with_start_and_end, padding_unary_scores], 1)
+                end_mask = tf.equal(tf.expand_dims(tf.range(max_sequence_length + 2), 0), tf.expand_dims(self.input_sequence_lengths + 1, 1))
+                end_mask_expanded = tf.tile(tf.expand_dims(end_mask, axis=2), [1, 1, dataset.number_of_classes + 2])
+                self.unary_scores = tf.where(end_mask_expanded, tf.zeros_like(unary_scores_with_start_and_end) + end_unary_scores, unary_scores_with_start_and_end)
                 start_index = dataset.number_of_classes
                 end_index = dataset.number_of_classes + 1
-                input_label_indices_flat_with_start_and_end = tf.concat([ tf.constant(start_index, shape=[1]), self.input_label_indices_flat, tf.constant(end_index, shape=[1]) ], 0)
+                input_label_indices_flat_with_start_and_end = tf.concat([tf.fill([batch_size, 1], start_index), self.input_label_indices_flat,
+                                                                         tf.fill([batch_size, 1], end_index)], 1)
+                input_label_indices_flat_with_start_and_end = tf.where(end_mask, tf.fill(tf.shape(end_mask), end_index), input_label_indices_flat_with_start_and_end)
 
                 # Apply CRF layer
-                sequence_length = tf.shape(self.unary_scores)[0]
-                sequence_lengths = tf.expand_dims(sequence_length, axis=0, name='sequence_lengths')
-                unary_scores_expanded = tf.expand_dims(self.unary_scores, axis=0, name='unary_scores_expanded')
-                input_label_indices_flat_batch = tf.expand_dims(input_label_indices_flat_with_start_and_end, axis=0, name='input_label_indices_flat_batch')
-                if self.verbose: print('unary_scores_expanded: {0}'.format(unary_scores_expanded))
-                if self.verbose: print('input_label_indices_flat_batch: {0}'.format(input_label_indices_flat_batch))
+                sequence_lengths = tf.add(self.input_sequence_lengths, 2, name='sequence_lengths')
+                if self.verbose: print('unary_scores: {0}'.format(self.unary_scores))
+                if self.verbose: print('input_label_indices_flat_with_start_and_end: {0}'.format(input_label_indices_flat_with_start_and_end))
                 if self.verbose: print("sequence_lengths: {0}".format(sequence_lengths))
                 # https://github.com/tensorflow/tensorflow/tree/master/tensorflow/contrib/crf
                 # Compute the log-likelihood of the gold sequences and keep the transition params for inference at test time.
@@ -185,11 +296,18 @@ class EntityLSTM(object):
                     "transitions",
                     shape=[dataset.number_of_classes+2, dataset.number_of_classes+2],
                     initializer=initializer)
-                utils_tf.variable_summaries(self.transition_parameters)
-                log_likelihood, _ = tf.contrib.crf.crf_log_likelihood(
-                    unary_scores_expanded, input_label_indices_flat_batch, sequence_lengths, transition_params=self.transition_parameters)
-                self.loss =  tf.reduce_mean(-log_likelihood, name='cross_entropy_mean_loss')
-                self.accuracy = tf.constant(1)
+                self.variable_summaries(self.transition_parameters)
+                if not inference_only:
+                    log_likelihood, _ = tf.contrib.crf.crf_log_likelihood(
+                        self.unary_scores, input_label_indices_flat_with_start_and_end, sequence_lengths, transition_params=self.transition_parameters)
+                    self.loss =  tf.reduce_mean(-log_likelihood, name='cross_entropy_mean_loss')
+                    self.accuracy = tf.constant(1)
+
+                # Viterbi decoding of the whole batch in the graph, masked by the sequence lengths
+                # The start and end tokens are removed from the predictions, which are then [batch_size, max_sequence_length] like the unary scores
+                # (the predictions after the end of each sentence are meaningless)
+                predictions_with_start_and_end, _ = tf.contrib.crf.crf_decode(self.unary_scores, self.transition_parameters, sequence_lengths)
+                self.predictions = tf.identity(predictions_with_start_and_end[:, 1:-1], name='predictions')
 
                 self.crf_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=vs.name)
 
@@ -200,25 +318,41 @@ class EntityLSTM(object):
                     "transitions",
                     shape=[dataset.number_of_classes+2, dataset.number_of_classes+2],
                     initializer=initializer)
-                utils_tf.variable_summaries(self.transition_parameters)
+                self.variable_summaries(self.transition_parameters)
                 self.crf_variables = tf.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES, scope=vs.name)
 
-            # Calculate mean cross-entropy loss
-            with tf.variable_scope("loss"):
-                losses = tf.nn.softmax_cross_entropy_with_logits(logits=self.unary_scores, labels=self.input_label_indices_vector, name='softmax')
-                self.loss =  tf.reduce_mean(losses, name='cross_entropy_mean_loss')
-            with tf.variable_scope("accuracy"):
-                correct_predictions = tf.equal(self.predictions, tf.argmax(self.input_label_indices_vector, 1))
-                self.accuracy = tf.reduce_mean(tf.cast(correct_predictions, 'float'), name='accuracy')
-
-        self.define_training_procedure(parameters)
-        self.summary_op = tf.summary.merge_all()
+            if not inference_only:
+                # Calculate mean cross-entropy loss
+                # Padded tokens are masked out, and each sentence is averaged over its own tokens as with batch size 1
+                sequence_lengths = tf.cast(self.input_sequence_lengths, tf.float32)
+                with tf.variable_scope("loss"):
+                    losses = tf.nn.softmax_cross_entropy_with_logits(logits=self.unary_scores, labels=self.input_label_indices_vector, name='softmax')
+                    losses = tf.reduce_sum(losses * sequence_mask, axis=1) / sequence_lengths
+                    self.loss =  tf.reduce_mean(losses, name='cross_entropy_mean_loss')
+                with tf.variable_scope("accuracy"):
+                    correct_predictions = tf.cast(tf.equal(self.predictions, tf.argmax(self.input_label_indices_vector, 2)), 'float')
+                    self.accuracy = tf.divide(tf.reduce_sum(correct_predictions * sequence_mask), tf.reduce_sum(sequence_mask), name='accuracy')
+
+        if inference_only:
+            self.summary_op = None
+        else:
+            self.define_training_procedure(parameters)
+            self.summary_op = tf.summary.merge_all()
         self.saver = tf.train.Saver(max_to_keep=parameters['maximum_number_of_epochs'])  # defaults to saving all variables
 
+    def variable_summaries(self, var):
+        # The summaries are only needed for the training
+        if not self.inference_only:
+            utils_tf.variable_summaries(var)
+
     def define_training_procedure(self, parameters):
         # Define training procedure
         self.global_step = tf.Variable(0, name="global_step", trainable=False)
-        if parameters['optimizer'] == 'adam':
+        if parameters['optimizer'] == 'adam' and parameters['lazy_embedding_updates']:
+            # Only the rows of the embeddings that are in the batch (and their moments) are updated.
+            # The name of the slots is the same as with AdamOptimizer, so the checkpoints are interchangeable.
+            self.optimizer = tf.contrib.opt.LazyAdamOptimizer(parameters['learning_rate'], name='Adam')
+        elif parameters['optimizer'] == 'adam':
             self.optimizer = tf.train.AdamOptimizer(parameters['learning_rate'])
         elif parameters['optimizer'] == 'sgd':
             self.optimizer = tf.train.GradientDescentOptimizer(parameters['learning_rate'])
@@ -226,15 +360,24 @@ class EntityLSTM(object):
             self.optimizer = tf.train.AdadeltaOptimizer(parameters['learning_rate'])
         else:
             raise ValueError('The lr_method parameter must be either adadelta, adam or sgd.')
+        if parameters['number_of_workers'] > 1:
+            # Average the gradients computed by all the workers before applying them (see distributed.LocalCluster)
+            self.optimizer = tf.train.SyncReplicasOptimizer(self.optimizer, replicas_to_aggregate=parameters['number_of_workers'],
+                                                            total_num_replicas=parameters['number_of_workers'])
+            self.sync_optimizer = self.optimizer
 
         grads_and_vars = self.optimizer.compute_gradients(self.loss)
         if parameters['gradient_clipping_value']:
-            grads_and_vars = [(tf.clip_by_value(grad, -parameters['gradient_clipping_value'], parameters['gradient_clipping_value']), var) 
-                              for grad, var in grads_and_vars]
+            grads_and_vars = [(clip_gradient_by_value(grad, parameters['gradient_clipping_value']), var) for grad, var in grads_and_vars]
         # By defining a global_step variable and passing it to the optimizer we allow TensorFlow handle the counting of training steps for us.
         # The global step will be automatically incremented by one every time you execute train_op.
         self.train_op = self.optimizer.apply_gradients(grads_and_vars, global_step=self.global_step)
 
+    def load_infrequent_token_mask(self, sess, dataset):
+        infrequent_token_mask = np.zeros(dataset.vocabulary_size, dtype=bool)
+        infrequent_token_mask[dataset.infrequent_token_indices] = True
+        self.infrequent_token_mask.load(infrequent_token_mask, sess)
+
     def load_pretrained_token_embeddings(self, sess, dataset, parameters, token_to_vector=None):
         if parameters['token_pretrained_embedding_filepath'] == '':
             return
@@ -74,23 +74,21 @@ def plot_f1_vs_epoch(results, stats_graph_folder, metric, parameters, from_json=
     else:
         epoch_idxs = sorted(map(int, results['epoch'].keys()))    # when loading json file
 
-    dataset_types = []
-    for dataset_type in ['train', 'valid', 'test']:
-        if dataset_type in results['epoch'][epoch_idxs[0]][-1]:
-            dataset_types.append(dataset_type)
-    if len(dataset_type) < 2:
-        return
-
+    # Each dataset type may be evaluated only at some epochs (see validation_frequency and train_evaluation_sample_size)
     f1_dict_all = {}
-    for dataset_type in dataset_types:
-        f1_dict_all[dataset_type] = []
+    dataset_epoch_idxs = {}
     for eidx in epoch_idxs:
         if not from_json:
             result_epoch = results['epoch'][eidx][-1]
         else:
             result_epoch = results['epoch'][str(eidx)][-1]    # when loading json file
-        for dataset_type in dataset_types:
-            f1_dict_all[dataset_type].append(result_epoch[dataset_type][metric])
+        for dataset_type in ['train', 'valid', 'test']:
+            if dataset_type in result_epoch:
+                f1_dict_all.setdefault(dataset_type, []).append(result_epoch[dataset_type][metric])
+                dataset_epoch_idxs.setdefault(dataset_type, []).append(eidx)
+    dataset_types = [dataset_type for dataset_type in ['train', 'valid', 'test'] if dataset_type in f1_dict_all]
+    if 'valid' not in dataset_types:
+        return
 
 
     # Plot micro f1 vs epoch for all classes
@@ -104,13 +102,15 @@ def plot_f1_vs_epoch(results, stats_graph_folder, metric, parameters, from_json=
         else:
             f1 = [score_value for score_value in f1_dict_all[dataset_type]]
         results[dataset_type]['best_{0}'.format(metric)] = max(f1)
-        results[dataset_type]['epoch_for_best_{0}'.format(metric)] = int(np.asarray(f1).argmax())
-        f1_all[dataset_type] = f1
-        plot_handles.extend(plt.plot(epoch_idxs, f1, '-', label=dataset_type + ' (max: {0:.4f})'.format(results[dataset_type]['best_{0}'.format(metric)])))
+        results[dataset_type]['epoch_for_best_{0}'.format(metric)] = dataset_epoch_idxs[dataset_type][int(np.asarray(f1).argmax())]
+        f1_all[dataset_type] = dict(zip(dataset_epoch_idxs[dataset_type], f1))
+        plot_handles.extend(plt.plot(dataset_epoch_idxs[dataset_type], f1, '-', label=dataset_type + ' (max: {0:.4f})'.format(results[dataset_type]['best_{0}'.format(metric)])))
     # Record the best values according to the best epoch for valid
     best_epoch = results['valid']['epoch_for_best_{0}'.format(metric)]
     plt.axvline(x=best_epoch, color='k', linestyle=':')   # Add a vertical line at best epoch for valid
     for dataset_type in dataset_types:
+        if best_epoch not in f1_all[dataset_type]:
+            continue
         best_score_based_on_valid = f1_all[dataset_type][best_epoch]
         results[dataset_type]['best_{0}_based_on_valid'.format(metric)] = best_score_based_on_valid
         if dataset_type == 'test':
@@ -219,9 +219,14 @@ def remap_labels(y_pred, y_true, dataset, evaluation_mode='bio'):
 
 
 def evaluate_model(results, dataset, y_pred_all, y_true_all, stats_graph_folder, epoch_number, epoch_start_time, output_filepaths, parameters, verbose=False):
+    '''
+    Evaluate the predictions of each dataset type in output_filepaths for epoch_number.
+    The model can be evaluated several times for the same epoch on different dataset types: the results are then merged.
+    '''
     results['execution_details']['num_epochs'] = epoch_number
-    results['epoch'][epoch_number] = []
-    result_update = {}
+    if epoch_number not in results['epoch']:
+        results['epoch'][epoch_number] = [{}]
+    result_update = results['epoch'][epoch_number][0]
 
     for dataset_type in ['train', 'valid', 'test']:
         if dataset_type not in output_filepaths.keys():
@@ -242,7 +247,6 @@ def evaluate_model(results, dataset, y_pred_all, y_true_all, stats_graph_folder,
 
     result_update['time_elapsed_since_epoch_start'] = time.time() - epoch_start_time
     result_update['time_elapsed_since_train_start'] = time.time() - results['execution_details']['train_start']
-    results['epoch'][epoch_number].append(result_update)
 
     # CoNLL evaluation script
     for dataset_type in ['train', 'valid', 'test']:
@@ -269,7 +273,7 @@ def evaluate_model(results, dataset, y_pred_all, y_true_all, stats_graph_folder,
                         dpi=300, format=parameters['plot_format'], bbox_inches='tight')
             plt.close()
 
-    if  parameters['train_model'] and 'train' in output_filepaths.keys() and 'valid' in output_filepaths.keys():
+    if  parameters['train_model'] and 'valid' in results['epoch'][epoch_number][0]:
         plot_f1_vs_epoch(results, stats_graph_folder, 'f1_score', parameters)
         plot_f1_vs_epoch(results, stats_graph_folder, 'accuracy_score', parameters)
         plot_f1_vs_epoch(results, stats_graph_folder, 'f1_conll', parameters)
@@ -0,0 +1,207 @@
+'''
+Export of a trained model as a single frozen inference graph, and the model that runs it for prediction
+'''
+import numpy as np
+import sklearn.metrics
+import tensorflow as tf
+from tensorflow.contrib.rnn.python.ops import lstm_ops  # registers BlockLSTM kernels for the imported GraphDef
+from tensorflow.python.framework import tensor_util
+from tensorflow.tools.graph_transforms import TransformGraph
+from entity_lstm import EntityLSTM
+import evaluate
+import sampler
+import train
+
+FROZEN_MODEL_FILENAME = 'frozen_model.pb'
+# Variables that are quantized to int8 when the frozen model is exported with quantize=True
+QUANTIZED_EMBEDDING_VARIABLES = ['token_embedding/token_embedding_weights', 'character_embedding/character_embedding_weights']
+QUANTIZED_DENSE_VARIABLES = ['feedforward_after_lstm/W', 'feedforward_before_crf/W']
+INPUT_NAMES = ['input_token_indices', 'input_token_character_indices', 'input_token_lengths', 'input_token_unique_indices', 'input_sequence_lengths',
+               'dropout_keep_prob', 'character_lstm_output']
+
+
+def quantize_rows(values):
+    '''
+    Quantize each row of the 2-D array values to int8 with its own scale.
+    Return the quantized values and the scales [number_of_rows, 1], such that values is approximately quantized * scales.
+    '''
+    scales = np.max(np.abs(values), axis=1, keepdims=True) / 127.
+    scales[scales == 0] = 1.
+    quantized = np.clip(np.round(values / scales), -127, 127).astype(np.int8)
+    return quantized, scales.astype(values.dtype)
+
+
+def _make_node(op, name, inputs, **attributes):
+    node = tf.NodeDef(op=op, name=name, input=inputs)
+    for key, value in attributes.items():
+        node.attr[key].CopyFrom(value)
+    return node
+
+
+def _make_constant_node(name, values):
+    return _make_node('Const', name, [], dtype=tf.AttrValue(type=tf.as_dtype(values.dtype).as_datatype_enum),
+                      value=tf.AttrValue(tensor=tf.make_tensor_proto(values)))
+
+
+def quantize_graph_def(graph_def, embedding_values, dense_values, output_names):
+    '''
+    Replace the embedding tables and the weights of the dense layers of the frozen graph_def by int8 constants, which are dequantized on the fly.
+    embedding_values and dense_values map the names of the variables to quantize to their values. The constants of the folded graph are
+    identified by their values, as their names are not stable.
+    The embedding tables are quantized per row, and their rows are gathered before being dequantized, so the whole table is never dequantized.
+    The weights of the dense layers are quantized per output unit (i.e. per column), and dequantized before the matrix multiplication.
+    '''
+    nodes = {node.name: node for node in graph_def.node}
+
+    def get_constant_input(input_name):
+        node = nodes[input_name.split(':')[0].lstrip('^')]
+        while node.op == 'Identity':
+            node = nodes[node.input[0].split(':')[0].lstrip('^')]
+        return tensor_util.MakeNdarray(node.attr['value'].tensor) if node.op == 'Const' else None
+
+    def is_one_of(values, candidate_values):
+        return values is not None and any(values.shape == candidate.shape and np.array_equal(values, candidate) for candidate in candidate_values)
+
+    int8_type = tf.AttrValue(type=tf.int8.as_datatype_enum)
+    quantized_graph_def = tf.GraphDef()
+    quantized_graph_def.versions.CopyFrom(graph_def.versions)
+    quantized_graph_def.library.CopyFrom(graph_def.library)
+    for node in graph_def.node:
+        if node.op in ['Gather', 'GatherV2'] and is_one_of(get_constant_input(node.input[0]), embedding_values.values()):
+            quantized, scales = quantize_rows(get_constant_input(node.input[0]))
+            quantized_rows = tf.NodeDef()
+            quantized_rows.CopyFrom(node)
+            quantized_rows.name = node.name + '/quantized_rows'
+            quantized_rows.input[0] = node.name + '/quantized_weights'
+            quantized_rows.attr['Tparams'].CopyFrom(int8_type)
+            scale_rows = tf.NodeDef()
+            scale_rows.CopyFrom(node)
+            scale_rows.name = node.name + '/scale_rows'
+            scale_rows.input[0] = node.name + '/scales'
+            # The dequantized rows replace the output of the original gather
+            quantized_graph_def.node.extend([
+                _make_constant_node(node.name + '/quantized_weights', quantized),
+                _make_constant_node(node.name + '/scales', scales),
+                quantized_rows,
+                scale_rows,
+                _make_node('Cast', node.name + '/dequantized_rows', [quantized_rows.name], SrcT=int8_type, DstT=node.attr['Tparams']),
+                _make_node('Mul', node.name, [node.name + '/dequantized_rows', scale_rows.name], T=node.attr['Tparams'])])
+        elif node.op == 'MatMul' and not node.attr['transpose_b'].b and is_one_of(get_constant_input(node.input[1]), dense_values.values()):
+            quantized, scales = quantize_rows(get_constant_input(node.input[1]).T)
+            matmul = tf.NodeDef()
+            matmul.CopyFrom(node)
+            matmul.input[1] = node.name + '/dequantized_weights'
+            quantized_graph_def.node.extend([
+                _make_constant_node(node.name + '/quantized_weights', quantized.T),
+                _make_constant_node(node.name + '/scales', scales.T),
+                _make_node('Cast', node.name + '/cast_weights', [node.name + '/quantized_weights'], SrcT=int8_type, DstT=node.attr['T']),
+                _make_node('Mul', node.name + '/dequantized_weights', [node.name + '/cast_weights', node.name + '/scales'], T=node.attr['T']),
+                matmul])
+        else:
+            quantized_graph_def.node.extend([node])
+    # Remove the float constants, which are not used anymore
+    return tf.graph_util.extract_sub_graph(quantized_graph_def, output_names)
+
+
+def export_frozen_model(sess, dataset, parameters, output_filepath, quantize=False):
+    '''
+    Write the inference graph of the model of sess to output_filepath as a single GraphDef, with its variables frozen into constants.
+    The graph is rebuilt with inference_only=True and without tf.data input pipeline, so it contains neither the training procedure
+    nor the summaries, and its inputs are plain placeholders. The constant subgraphs (e.g. the start and end scores of the CRF) are then folded.
+    If quantize is True, the token and character embeddings and the weights of the feedforward layers are quantized to int8 (see quantize_graph_def).
+    '''
+    variable_values = sess.run({variable.op.name: variable for variable in sess.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)})
+    with tf.Graph().as_default() as graph:
+        model = EntityLSTM(dataset, parameters, inference_only=True)
+        # The outputs get fixed names, which FrozenEntityLSTM relies on
+        outputs = {'predictions': model.predictions,
+                   'unary_scores': model.unary_scores,
+                   'transition_parameters': model.transition_parameters}
+        if parameters['use_character_lstm']:
+            outputs['token_character_lstm_output'] = model.token_character_lstm_output
+        for name, tensor in outputs.items():
+            tf.identity(tensor, name=name)
+        with tf.Session() as frozen_sess:
+            frozen_sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+            for variable in tf.global_variables():
+                variable.load(variable_values[variable.op.name], frozen_sess)
+            graph_def = tf.graph_util.convert_variables_to_constants(frozen_sess, graph.as_graph_def(), list(outputs.keys()))
+    # The placeholders of the labels are not needed for the predictions, so they are not in the frozen graph
+    node_names = set(node.name for node in graph_def.node)
+    input_names = [name for name in INPUT_NAMES if name in node_names]
+    graph_def = TransformGraph(graph_def, input_names, list(outputs.keys()), ['fold_constants(ignore_errors=true)', 'sort_by_execution_order'])
+    if quantize:
+        # The dequantization is done after the folding, which would otherwise fold it back into float constants
+        float_size = graph_def.ByteSize()
+        graph_def = quantize_graph_def(graph_def, {name: variable_values[name] for name in QUANTIZED_EMBEDDING_VARIABLES if name in variable_values},
+                                       {name: variable_values[name] for name in QUANTIZED_DENSE_VARIABLES}, list(outputs.keys()))
+        print('Quantized model size: {0:.1f} MB (float model size: {1:.1f} MB)'.format(graph_def.ByteSize() / 2**20, float_size / 2**20))
+    with tf.gfile.GFile(output_filepath, 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    print('Frozen model with {0} nodes written to {1}'.format(len(graph_def.node), output_filepath))
+
+
+def get_accuracy_delta(sess, model, dataset, dataset_type, frozen_model_filepath, parameters):
+    '''
+    Compare the predictions of the frozen model (e.g. quantized) with the ones of the model of sess on dataset_type.
+    Return the micro F1-scores (bio evaluation mode, in %) of both models, their difference and the fraction of tokens whose predicted label differs.
+    '''
+    with tf.Graph().as_default():
+        frozen_sess = tf.Session()
+        frozen_model = FrozenEntityLSTM(frozen_model_filepath)
+    y_pred = []
+    y_pred_frozen = []
+    y_true = []
+    for sequence_numbers in sampler.get_batch_sampler(dataset, dataset_type, parameters).get_batches(shuffle=False):
+        batch = train.get_batch(dataset, dataset_type, sequence_numbers)
+        predictions = sess.run(model.predictions, train.get_feed_dict(model, batch, 1.))
+        frozen_predictions = frozen_sess.run(frozen_model.predictions, train.get_feed_dict(frozen_model, batch, 1.))
+        for batch_index, i in enumerate(sequence_numbers):
+            sequence_length = batch['sequence_lengths'][batch_index]
+            y_pred.extend(predictions[batch_index, :sequence_length].tolist())
+            y_pred_frozen.extend(frozen_predictions[batch_index, :sequence_length].tolist())
+            y_true.extend(dataset.label_indices[dataset_type][i])
+    frozen_sess.close()
+
+    report = {}
+    for key, predictions in [('f1_score', y_pred), ('frozen_f1_score', y_pred_frozen)]:
+        new_y_pred, new_y_true, new_label_indices, _, _, _ = evaluate.remap_labels(predictions, y_true, dataset, 'bio')
+        report[key] = sklearn.metrics.f1_score(new_y_true, new_y_pred, average='micro', labels=new_label_indices) * 100
+    report['f1_score_delta'] = report['frozen_f1_score'] - report['f1_score']
+    report['changed_prediction_ratio'] = float(np.mean(np.array(y_pred) != np.array(y_pred_frozen)))
+    report['number_of_tokens'] = len(y_true)
+    return report
+
+
+class FrozenEntityLSTM(object):
+    """
+    Run the frozen inference graph written by export_frozen_model in the default graph.
+
+    It has the same inputs and outputs as EntityLSTM for prediction (see train.prediction_step), but neither the labels
+    nor the variables: the model cannot be trained, and the dataset must be the one the graph was exported with.
+    """
+    def __init__(self, frozen_model_filepath):
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(frozen_model_filepath, 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        tf.import_graph_def(graph_def, name='')
+        graph = tf.get_default_graph()
+
+        def get_tensor(name):
+            try:
+                return graph.get_tensor_by_name('{0}:0'.format(name))
+            except KeyError:
+                return None
+        self.input_token_indices = get_tensor('input_token_indices')
+        self.input_token_character_indices = get_tensor('input_token_character_indices')
+        self.input_token_lengths = get_tensor('input_token_lengths')
+        self.input_token_unique_indices = get_tensor('input_token_unique_indices')
+        self.input_sequence_lengths = get_tensor('input_sequence_lengths')
+        self.input_label_indices_vector = None
+        self.input_label_indices_flat = None
+        self.dropout_keep_prob = get_tensor('dropout_keep_prob')
+        self.character_lstm_output = get_tensor('character_lstm_output')
+        self.token_character_lstm_output = get_tensor('token_character_lstm_output')
+        self.predictions = get_tensor('predictions')
+        self.unary_scores = get_tensor('unary_scores')
+        self.transition_parameters = get_tensor('transition_parameters')
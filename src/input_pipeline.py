@@ -0,0 +1,107 @@
+'''
+tf.data input pipeline that prepares the padded batches for EntityLSTM in the background
+'''
+import numpy as np
+import tensorflow as tf
+
+
+class InputPipeline(object):
+    """
+    Pad the batches of sequences with graph operations in background threads and prefetch them,
+    so that the preparation of the next batches overlaps with the computation on the current one.
+
+    The index arrays of each dataset type are concatenated once into flat arrays, which are fed to the pipeline when it is initialized:
+    each sequence is sliced from them, the sequences of a batch are padded with padded_batch, and the characters of the distinct tokens
+    of the batch are gathered with tf.unique. No Python code runs per batch.
+
+    The batches of each epoch are given to initialize() as lists of sequence numbers (e.g. from sampler.BucketBatchSampler),
+    and are then consumed in the same order, one batch per sess.run, through next_batch.
+    """
+    def __init__(self, dataset, parameters):
+        self.dataset = dataset
+        self.number_of_parallel_calls = parameters['number_of_cpu_threads']
+        # Concatenated arrays of the dataset type, and of the batches of the epoch
+        self.placeholders = {'token_indices': tf.placeholder(tf.int32, [None]),
+                             'label_indices': tf.placeholder(tf.int32, [None]),
+                             'token_character_ids': tf.placeholder(tf.int32, [None]),
+                             'sequence_offsets': tf.placeholder(tf.int32, [None]),
+                             'sequence_lengths': tf.placeholder(tf.int32, [None]),
+                             'character_indices': tf.placeholder(tf.int32, [None, None]),
+                             'token_lengths': tf.placeholder(tf.int32, [None]),
+                             'batch_sequence_numbers': tf.placeholder(tf.int32, [None]),
+                             'batch_offsets': tf.placeholder(tf.int32, [None]),
+                             'batch_sizes': tf.placeholder(tf.int32, [None])}
+        data = tf.data.Dataset.from_tensor_slices((self.placeholders['batch_offsets'], self.placeholders['batch_sizes']))
+        data = data.flat_map(self._get_padded_sequences)
+        data = data.map(self._add_unique_tokens, num_parallel_calls=self.number_of_parallel_calls)
+        data = data.prefetch(self.number_of_parallel_calls)
+        self.iterator = tf.data.Iterator.from_structure(data.output_types, data.output_shapes)
+        self.next_batch = self.iterator.get_next()
+        self.initializer = self.iterator.make_initializer(data)
+        self.arrays = {}
+
+    def _get_sequence(self, sequence_number):
+        offset = self.placeholders['sequence_offsets'][sequence_number]
+        sequence_length = self.placeholders['sequence_lengths'][sequence_number]
+        sequence = {'sequence_numbers': sequence_number, 'sequence_lengths': sequence_length}
+        for key in ['token_indices', 'label_indices', 'token_character_ids']:
+            sequence[key] = self.placeholders[key][offset:offset + sequence_length]
+        return sequence
+
+    def _get_padded_sequences(self, batch_offset, batch_size):
+        sequence_numbers = self.placeholders['batch_sequence_numbers'][batch_offset:batch_offset + batch_size]
+        sequences = tf.data.Dataset.from_tensor_slices(sequence_numbers).map(self._get_sequence)
+        return sequences.padded_batch(tf.cast(batch_size, tf.int64), sequences.output_shapes)
+
+    def _add_unique_tokens(self, batch):
+        # Same outputs as train.get_batch: the unique tokens are numbered in the order of their first occurrence in the batch
+        mask = tf.sequence_mask(batch['sequence_lengths'], tf.shape(batch['token_indices'])[1])
+        unique_token_character_ids, token_unique_indices = tf.unique(tf.boolean_mask(batch.pop('token_character_ids'), mask))
+        batch['token_unique_indices'] = tf.scatter_nd(tf.where(mask), token_unique_indices, tf.shape(mask, out_type=tf.int64))
+        batch['token_lengths'] = tf.gather(self.placeholders['token_lengths'], unique_token_character_ids)
+        batch['character_indices'] = tf.gather(self.placeholders['character_indices'], unique_token_character_ids)[:, :tf.reduce_max(batch['token_lengths'])]
+        batch['label_vector_indices'] = tf.one_hot(batch['label_indices'], self.dataset.number_of_classes) * tf.expand_dims(tf.cast(mask, tf.float32), -1)
+        return batch
+
+    def _get_arrays(self, dataset_type):
+        '''
+        Concatenate the index arrays of the sequences of dataset_type, and number the distinct tokens by their characters,
+        since different tokens may be mapped to the same token index (e.g. UNK).
+        The arrays are recomputed only when the dataset type has been updated (e.g. by Dataset.update_dataset_from_tokens).
+        '''
+        token_indices = self.dataset.token_indices[dataset_type]
+        if dataset_type in self.arrays and self.arrays[dataset_type][0] is token_indices:
+            return self.arrays[dataset_type][1]
+        token_character_ids = {}
+        character_indices = []
+        sequence_token_character_ids = []
+        for sequence_character_indices in self.dataset.character_indices[dataset_type]:
+            for token_character_indices in sequence_character_indices:
+                key = tuple(token_character_indices)
+                if key not in token_character_ids:
+                    token_character_ids[key] = len(character_indices)
+                    character_indices.append(token_character_indices)
+                sequence_token_character_ids.append(token_character_ids[key])
+        sequence_lengths = np.array([len(sequence) for sequence in token_indices], dtype=np.int32)
+        arrays = {'token_indices': np.array([index for sequence in token_indices for index in sequence], dtype=np.int32),
+                  'label_indices': np.array([index for sequence in self.dataset.label_indices[dataset_type] for index in sequence], dtype=np.int32),
+                  'token_character_ids': np.array(sequence_token_character_ids, dtype=np.int32),
+                  'sequence_offsets': (np.cumsum(sequence_lengths) - sequence_lengths).astype(np.int32),
+                  'sequence_lengths': sequence_lengths,
+                  'token_lengths': np.array([len(token_character_indices) for token_character_indices in character_indices], dtype=np.int32)}
+        arrays['character_indices'] = np.full([len(character_indices), max(arrays['token_lengths'], default=0)], self.dataset.PADDING_CHARACTER_INDEX, dtype=np.int32)
+        for k, token_character_indices in enumerate(character_indices):
+            arrays['character_indices'][k, :len(token_character_indices)] = token_character_indices
+        self.arrays[dataset_type] = (token_indices, arrays)
+        return arrays
+
+    def initialize(self, sess, dataset_type, batches):
+        '''
+        Start feeding the given batches of dataset_type.
+        '''
+        batch_sizes = np.array([len(sequence_numbers) for sequence_numbers in batches], dtype=np.int32)
+        feed_dict = {self.placeholders[key]: value for key, value in self._get_arrays(dataset_type).items()}
+        feed_dict[self.placeholders['batch_sequence_numbers']] = np.array([i for sequence_numbers in batches for i in sequence_numbers], dtype=np.int32)
+        feed_dict[self.placeholders['batch_offsets']] = (np.cumsum(batch_sizes) - batch_sizes).astype(np.int32)
+        feed_dict[self.placeholders['batch_sizes']] = batch_sizes
+        sess.run(self.initializer, feed_dict)
@@ -182,7 +182,14 @@ def parse_arguments(arguments=None):
     parser.add_argument('--parameters_filepath', required=False, default=os.path.join('.','parameters.ini'), help='The parameters file')
 
     argument_default_value = 'argument_default_dummy_value_please_ignore_d41d8cd98f00b204e9800998ecf8427e'
+    parser.add_argument('--batch_size', required=False, default=argument_default_value, help='')
+    parser.add_argument('--batch_token_budget', required=False, default=argument_default_value, help='')
+    parser.add_argument('--bucket_boundaries', required=False, default=argument_default_value, help='')
+    parser.add_argument('--character_cnn_filter_widths', required=False, default=argument_default_value, help='')
+    parser.add_argument('--character_cnn_number_of_filters', required=False, default=argument_default_value, help='')
     parser.add_argument('--character_embedding_dimension', required=False, default=argument_default_value, help='')
+    parser.add_argument('--character_encoder', required=False, default=argument_default_value, help='')
+    parser.add_argument('--character_lstm_cache_size', required=False, default=argument_default_value, help='')
     parser.add_argument('--character_lstm_hidden_state_dimension', required=False, default=argument_default_value, help='')
     parser.add_argument('--check_for_digits_replaced_with_zeros', required=False, default=argument_default_value, help='')
     parser.add_argument('--check_for_lowercase', required=False, default=argument_default_value, help='')
@@ -192,17 +199,24 @@ def parse_arguments(arguments=None):
     parser.add_argument('--experiment_name', required=False, default=argument_default_value, help='')
     parser.add_argument('--freeze_token_embeddings', required=False, default=argument_default_value, help='')
     parser.add_argument('--gradient_clipping_value', required=False, default=argument_default_value, help='')
+    parser.add_argument('--input_pipeline', required=False, default=argument_default_value, help='')
+    parser.add_argument('--lazy_embedding_updates', required=False, default=argument_default_value, help='')
     parser.add_argument('--learning_rate', required=False, default=argument_default_value, help='')
     parser.add_argument('--load_only_pretrained_token_embeddings', required=False, default=argument_default_value, help='')
     parser.add_argument('--load_all_pretrained_token_embeddings', required=False, default=argument_default_value, help='')
+    parser.add_argument('--lstm_cell_type', required=False, default=argument_default_value, help='')
     parser.add_argument('--main_evaluation_mode', required=False, default=argument_default_value, help='')
     parser.add_argument('--maximum_number_of_epochs', required=False, default=argument_default_value, help='')
+    parser.add_argument('--maximum_training_time', required=False, default=argument_default_value, help='')
+    parser.add_argument('--number_of_checkpoints_to_keep', required=False, default=argument_default_value, help='')
     parser.add_argument('--number_of_cpu_threads', required=False, default=argument_default_value, help='')
     parser.add_argument('--number_of_gpus', required=False, default=argument_default_value, help='')
+    parser.add_argument('--number_of_workers', required=False, default=argument_default_value, help='')
     parser.add_argument('--optimizer', required=False, default=argument_default_value, help='')
     parser.add_argument('--output_folder', required=False, default=argument_default_value, help='')
     parser.add_argument('--patience', required=False, default=argument_default_value, help='')
     parser.add_argument('--plot_format', required=False, default=argument_default_value, help='')
+    parser.add_argument('--precompute_character_lstm', required=False, default=argument_default_value, help='')
     parser.add_argument('--pretrained_model_folder', required=False, default=argument_default_value, help='')
     parser.add_argument('--reload_character_embeddings', required=False, default=argument_default_value, help='')
     parser.add_argument('--reload_character_lstm', required=False, default=argument_default_value, help='')
@@ -211,16 +225,23 @@ def parse_arguments(arguments=None):
     parser.add_argument('--reload_token_embeddings', required=False, default=argument_default_value, help='')
     parser.add_argument('--reload_token_lstm', required=False, default=argument_default_value, help='')
     parser.add_argument('--remap_unknown_tokens_to_unk', required=False, default=argument_default_value, help='')
+    parser.add_argument('--resume_training_folder', required=False, default=argument_default_value, help='')
     parser.add_argument('--spacylanguage', required=False, default=argument_default_value, help='')
+    parser.add_argument('--stream_chunk_size', required=False, default=argument_default_value, help='')
+    parser.add_argument('--stream_deploy', required=False, default=argument_default_value, help='')
     parser.add_argument('--tagging_format', required=False, default=argument_default_value, help='')
     parser.add_argument('--token_embedding_dimension', required=False, default=argument_default_value, help='')
     parser.add_argument('--token_lstm_hidden_state_dimension', required=False, default=argument_default_value, help='')
     parser.add_argument('--token_pretrained_embedding_filepath', required=False, default=argument_default_value, help='')
     parser.add_argument('--tokenizer', required=False, default=argument_default_value, help='')
+    parser.add_argument('--training_log_frequency', required=False, default=argument_default_value, help='')
+    parser.add_argument('--train_evaluation_sample_size', required=False, default=argument_default_value, help='')
     parser.add_argument('--train_model', required=False, default=argument_default_value, help='')
     parser.add_argument('--use_character_lstm', required=False, default=argument_default_value, help='')
     parser.add_argument('--use_crf', required=False, default=argument_default_value, help='')
+    parser.add_argument('--use_frozen_model', required=False, default=argument_default_value, help='')
     parser.add_argument('--use_pretrained_model', required=False, default=argument_default_value, help='')
+    parser.add_argument('--validation_frequency', required=False, default=argument_default_value, help='')
     parser.add_argument('--verbose', required=False, default=argument_default_value, help='')
 
     try:
@@ -5,20 +5,29 @@ import dataset as ds
 import tensorflow as tf
 from tensorflow.contrib.tensorboard.plugins import projector
 from entity_lstm import EntityLSTM
+from frozen_model import FrozenEntityLSTM, FROZEN_MODEL_FILENAME
+import frozen_model
+from input_pipeline import InputPipeline
+from character_lstm_cache import CharacterLSTMCache
+from distributed import LocalCluster
+from checkpoint_writer import CheckpointWriter, load_training_state
 import utils
 import os
 import conll_to_brat
 import glob
 import codecs
 import shutil
+import itertools
 import time
 import copy
 import evaluate
 import random
 import pickle
+import json
 import brat_to_conll
 import numpy as np
 import utils_nlp
+import sampler
 import distutils
 import configparser
 from pprint import pprint
@@ -51,7 +60,14 @@ class NeuroNER(object):
         '''
         parameters = {'pretrained_model_folder':'../trained_models/conll_2003_en',
                       'dataset_text_folder':'../data/conll2003/en',
+                      'batch_size':1,
+                      'batch_token_budget':0,
+                      'bucket_boundaries':'',
+                      'character_cnn_filter_widths':'2 3 4',
+                      'character_cnn_number_of_filters':25,
                       'character_embedding_dimension':25,
+                      'character_encoder':'lstm',
+                      'character_lstm_cache_size':10000,
                       'character_lstm_hidden_state_dimension':25,
                       'check_for_digits_replaced_with_zeros':True,
                       'check_for_lowercase':True,
@@ -60,17 +76,24 @@ class NeuroNER(object):
                       'experiment_name':'test',
                       'freeze_token_embeddings':False,
                       'gradient_clipping_value':5.0,
+                      'input_pipeline':'tf_data',
+                      'lazy_embedding_updates':True,
                       'learning_rate':0.005,
                       'load_only_pretrained_token_embeddings':False,
                       'load_all_pretrained_token_embeddings':False,
+                      'lstm_cell_type':'cifg',
                       'main_evaluation_mode':'conll',
                       'maximum_number_of_epochs':100,
+                      'maximum_training_time':0,
+                      'number_of_checkpoints_to_keep':3,
                       'number_of_cpu_threads':8,
                       'number_of_gpus':0,
+                      'number_of_workers':1,
                       'optimizer':'sgd',
                       'output_folder':'../output',
                       'patience':10,
                       'plot_format':'pdf',
+                      'precompute_character_lstm':False,
                       'reload_character_embeddings':True,
                       'reload_character_lstm':True,
                       'reload_crf':True,
@@ -78,16 +101,23 @@ class NeuroNER(object):
                       'reload_token_embeddings':True,
                       'reload_token_lstm':True,
                       'remap_unknown_tokens_to_unk':True,
+                      'resume_training_folder':'',
                       'spacylanguage':'en',
+                      'stream_chunk_size':100,
+                      'stream_deploy':False,
                       'tagging_format':'bioes',
                       'token_embedding_dimension':100,
                       'token_lstm_hidden_state_dimension':100,
                       'token_pretrained_embedding_filepath':'../data/word_vectors/glove.6B.100d.txt',
                       'tokenizer':'spacy',
+                      'training_log_frequency':10,
+                      'train_evaluation_sample_size':-1,
                       'train_model':True,
                       'use_character_lstm':True,
                       'use_crf':True,
+                      'use_frozen_model':False,
                       'use_pretrained_model':False,
+                      'validation_frequency':1,
                       'verbose':False}
         # If a parameter file is specified, load it
         if len(parameters_filepath) > 0:
@@ -107,19 +137,21 @@ class NeuroNER(object):
                 v = random.choice(v.split(','))
                 parameters[k] = v
             # Ensure that each parameter is cast to the correct type
-            if k in ['character_embedding_dimension','character_lstm_hidden_state_dimension','token_embedding_dimension',
-                     'token_lstm_hidden_state_dimension','patience','maximum_number_of_epochs','maximum_training_time','number_of_cpu_threads','number_of_gpus']:
+            if k in ['batch_size','batch_token_budget','character_embedding_dimension','character_lstm_hidden_state_dimension','token_embedding_dimension',
+                     'token_lstm_hidden_state_dimension','patience','maximum_number_of_epochs','maximum_training_time','number_of_checkpoints_to_keep','number_of_cpu_threads','number_of_gpus',
+                     'number_of_workers','training_log_frequency','train_evaluation_sample_size','validation_frequency','character_lstm_cache_size','character_cnn_number_of_filters','stream_chunk_size']:
                 parameters[k] = int(v)
             elif k in ['dropout_rate', 'learning_rate', 'gradient_clipping_value']:
                 parameters[k] = float(v)
             elif k in ['remap_unknown_tokens_to_unk', 'use_character_lstm', 'use_crf', 'train_model', 'use_pretrained_model', 'debug', 'verbose',
                      'reload_character_embeddings', 'reload_character_lstm', 'reload_token_embeddings', 'reload_token_lstm', 'reload_feedforward', 'reload_crf',
-                     'check_for_lowercase', 'check_for_digits_replaced_with_zeros', 'freeze_token_embeddings', 'load_only_pretrained_token_embeddings', 'load_all_pretrained_token_embeddings']:
+                     'check_for_lowercase', 'check_for_digits_replaced_with_zeros', 'freeze_token_embeddings', 'load_only_pretrained_token_embeddings', 'load_all_pretrained_token_embeddings', 'precompute_character_lstm', 'use_frozen_model', 'lazy_embedding_updates', 'stream_deploy']:
                 parameters[k] = distutils.util.strtobool(v)
         # If loading pretrained model, set the model hyperparameters according to the pretraining parameters 
         if parameters['use_pretrained_model']:
             pretraining_parameters = self._load_parameters(parameters_filepath=os.path.join(parameters['pretrained_model_folder'], 'parameters.ini'), verbose=False)[0]
-            for name in ['use_character_lstm', 'character_embedding_dimension', 'character_lstm_hidden_state_dimension', 'token_embedding_dimension', 'token_lstm_hidden_state_dimension', 'use_crf']:
+            for name in ['use_character_lstm', 'character_embedding_dimension', 'character_lstm_hidden_state_dimension', 'token_embedding_dimension', 'token_lstm_hidden_state_dimension', 'use_crf',
+                         'lstm_cell_type', 'character_encoder', 'character_cnn_filter_widths', 'character_cnn_number_of_filters']:
                 if parameters[name] != pretraining_parameters[name]:
                     print('WARNING: parameter {0} was overwritten from {1} to {2} to be consistent with the pretrained model'.format(name, parameters[name], pretraining_parameters[name]))
                     parameters[name] = pretraining_parameters[name]
@@ -133,6 +165,12 @@ class NeuroNER(object):
 
         return parameters, conf_parameters    
     
+    def _get_tokenizer_model(self, parameters):
+        # The tokenizer is loaded only when a text needs to be tokenized, and then kept for the lifetime of the instance
+        if self.tokenizer_model is None:
+            self.tokenizer_model = brat_to_conll.load_tokenizer(parameters['tokenizer'], parameters['spacylanguage'])
+        return self.tokenizer_model
+
     def _get_valid_dataset_filepaths(self, parameters, dataset_types=['train', 'valid', 'test', 'deploy']):
         dataset_filepaths = {}
         dataset_brat_folders = {}
@@ -168,7 +206,8 @@ class NeuroNER(object):
                         conll_to_brat.check_compatibility_between_conll_and_brat_text(dataset_filepath_for_tokenizer, dataset_brat_folders[dataset_type])
                     else:
                         # Populate conll file based on brat files
-                        brat_to_conll.brat_to_conll(dataset_brat_folders[dataset_type], dataset_filepath_for_tokenizer, parameters['tokenizer'], parameters['spacylanguage'])
+                        brat_to_conll.brat_to_conll(dataset_brat_folders[dataset_type], dataset_filepath_for_tokenizer, parameters['tokenizer'], parameters['spacylanguage'],
+                                                    tokenizer_model=self._get_tokenizer_model(parameters))
                     dataset_filepaths[dataset_type] = dataset_filepath_for_tokenizer
     
                 # Brat text files do not exist
@@ -193,7 +232,7 @@ class NeuroNER(object):
         elif parameters['use_pretrained_model']:
             if 'train' in dataset_filepaths and 'valid' in dataset_filepaths:
                 print("WARNING: train and valid set exist in the specified dataset folder, but train_model is set to FALSE: {0}".format(parameters['dataset_text_folder']))
-            if 'test' not in dataset_filepaths and 'deploy' not in dataset_filepaths:
+            if 'test' not in dataset_filepaths and 'deploy' not in dataset_filepaths and not parameters['stream_deploy']:
                 raise IOError("For prediction mode, either test set and deploy set must exist in the specified dataset folder: {0}".format(parameters['dataset_text_folder']))
         else: #if not parameters['train_model'] and not parameters['use_pretrained_model']:
             raise ValueError('At least one of train_model and use_pretrained_model must be set to True.')
@@ -205,12 +244,62 @@ class NeuroNER(object):
         if parameters['gradient_clipping_value'] < 0:
             parameters['gradient_clipping_value'] = abs(parameters['gradient_clipping_value'])
 
+        if parameters['input_pipeline'] not in ['tf_data', 'feed_dict']:
+            raise ValueError("input_pipeline must be either 'tf_data' or 'feed_dict'.")
+
+        if parameters['resume_training_folder'] and not parameters['train_model']:
+            raise ValueError('If resume_training_folder is specified, train_model must be set to True.')
+
+        if parameters['use_frozen_model']:
+            if parameters['train_model'] or not parameters['use_pretrained_model']:
+                raise ValueError('If use_frozen_model is set to True, train_model must be set to False and use_pretrained_model must be set to True.')
+            # The frozen graph has plain placeholders as inputs
+            parameters['input_pipeline'] = 'feed_dict'
+
+        if parameters['stream_deploy']:
+            if parameters['train_model']:
+                raise ValueError('If stream_deploy is set to True, train_model must be set to False.')
+            if not os.path.isdir(os.path.join(parameters['dataset_text_folder'], 'deploy')):
+                raise IOError("If stream_deploy is set to True, the deploy brat folder must exist in the specified dataset folder: {0}".format(parameters['dataset_text_folder']))
+            if parameters['stream_chunk_size'] <= 0:
+                raise ValueError('stream_chunk_size must be positive.')
+
+        if parameters['lstm_cell_type'] not in ['cifg', 'fused']:
+            raise ValueError("lstm_cell_type must be either 'cifg' or 'fused'.")
+
+        if parameters['character_encoder'] not in ['lstm', 'cnn']:
+            raise ValueError("character_encoder must be either 'lstm' or 'cnn'.")
+        if parameters['character_encoder'] == 'cnn':
+            if len(str(parameters['character_cnn_filter_widths']).split()) == 0 or parameters['character_cnn_number_of_filters'] < 1:
+                raise ValueError('If character_encoder is cnn, character_cnn_filter_widths must not be empty and character_cnn_number_of_filters must be at least 1.')
+
+        if parameters['validation_frequency'] < 1:
+            raise ValueError('validation_frequency must be at least 1.')
+
+        if parameters['character_lstm_cache_size'] < 0:
+            raise ValueError('character_lstm_cache_size must be non-negative.')
+        if parameters['train_model'] or not parameters['use_character_lstm']:
+            # The character LSTM outputs change during the training
+            parameters['precompute_character_lstm'] = False
+
+        if parameters['number_of_workers'] < 1:
+            raise ValueError('number_of_workers must be at least 1.')
+        if not parameters['train_model']:
+            parameters['number_of_workers'] = 1
+
 
     def __init__(self,
                  parameters_filepath=argument_default_value, 
                  pretrained_model_folder=argument_default_value,
                  dataset_text_folder=argument_default_value, 
+                 batch_size=argument_default_value,
+                 batch_token_budget=argument_default_value,
+                 bucket_boundaries=argument_default_value,
+                 character_cnn_filter_widths=argument_default_value,
+                 character_cnn_number_of_filters=argument_default_value,
                  character_embedding_dimension=argument_default_value,
+                 character_encoder=argument_default_value,
+                 character_lstm_cache_size=argument_default_value,
                  character_lstm_hidden_state_dimension=argument_default_value,
                  check_for_digits_replaced_with_zeros=argument_default_value,
                  check_for_lowercase=argument_default_value,
@@ -219,17 +308,24 @@ class NeuroNER(object):
                  experiment_name=argument_default_value,
                  freeze_token_embeddings=argument_default_value,
                  gradient_clipping_value=argument_default_value,
+                 input_pipeline=argument_default_value,
+                 lazy_embedding_updates=argument_default_value,
                  learning_rate=argument_default_value,
                  load_only_pretrained_token_embeddings=argument_default_value,
                  load_all_pretrained_token_embeddings=argument_default_value,
+                 lstm_cell_type=argument_default_value,
                  main_evaluation_mode=argument_default_value,
                  maximum_number_of_epochs=argument_default_value,
+                 maximum_training_time=argument_default_value,
+                 number_of_checkpoints_to_keep=argument_default_value,
                  number_of_cpu_threads=argument_default_value,
                  number_of_gpus=argument_default_value,
+                 number_of_workers=argument_default_value,
                  optimizer=argument_default_value,
                  output_folder=argument_default_value,
                  patience=argument_default_value,
                  plot_format=argument_default_value,
+                 precompute_character_lstm=argument_default_value,
                  reload_character_embeddings=argument_default_value,
                  reload_character_lstm=argument_default_value,
                  reload_crf=argument_default_value,
@@ -237,16 +333,23 @@ class NeuroNER(object):
                  reload_token_embeddings=argument_default_value,
                  reload_token_lstm=argument_default_value,
                  remap_unknown_tokens_to_unk=argument_default_value,
+                 resume_training_folder=argument_default_value,
                  spacylanguage=argument_default_value,
+                 stream_chunk_size=argument_default_value,
+                 stream_deploy=argument_default_value,
                  tagging_format=argument_default_value,
                  token_embedding_dimension=argument_default_value,
                  token_lstm_hidden_state_dimension=argument_default_value,
                  token_pretrained_embedding_filepath=argument_default_value,
                  tokenizer=argument_default_value,
+                 training_log_frequency=argument_default_value,
+                 train_evaluation_sample_size=argument_default_value,
                  train_model=argument_default_value,
                  use_character_lstm=argument_default_value,
                  use_crf=argument_default_value,
+                 use_frozen_model=argument_default_value,
                  use_pretrained_model=argument_default_value,
+                 validation_frequency=argument_default_value,
                  verbose=argument_default_value,
                  argument_default_value=argument_default_value):
         
@@ -255,12 +358,35 @@ class NeuroNER(object):
         
         # Initialize parameters
         parameters, conf_parameters = self._load_parameters(arguments['parameters_filepath'], arguments=arguments)
-        dataset_filepaths, dataset_brat_folders = self._get_valid_dataset_filepaths(parameters)
+        # The tokenizer is shared by the preparation of the dataset and the predictions, and loaded on demand
+        self.tokenizer_model = None
+        # A streamed deploy set is neither converted to conll nor loaded in the dataset
+        dataset_types = ['train', 'valid', 'test'] if parameters['stream_deploy'] else ['train', 'valid', 'test', 'deploy']
+        dataset_filepaths, dataset_brat_folders = self._get_valid_dataset_filepaths(parameters, dataset_types=dataset_types)
         self._check_parameter_compatiblity(parameters, dataset_filepaths)
 
         # Load dataset
-        dataset = ds.Dataset(verbose=parameters['verbose'], debug=parameters['debug'])
-        token_to_vector = dataset.load_dataset(dataset_filepaths, parameters)
+        if parameters['resume_training_folder']:
+            # The dataset and the token embeddings are restored from the interrupted training, so neither the dataset
+            # nor the pretrained token embeddings need to be loaded again
+            resume_model_folder = os.path.join(parameters['resume_training_folder'], 'model')
+            dataset = pickle.load(open(os.path.join(resume_model_folder, 'dataset.pickle'), 'rb'))
+            token_to_vector = None
+            training_state = load_training_state(resume_model_folder)
+        elif parameters['use_frozen_model']:
+            # The embeddings of the frozen model are constants for the vocabulary of the dataset it was exported with,
+            # so the splits are converted with the mappings of that dataset
+            dataset = pickle.load(open(os.path.join(parameters['pretrained_model_folder'], 'dataset.pickle'), 'rb'))
+            # The splits of the exported dataset (if any, see trim_dataset_pickle in prepare_pretrained_model.py) are not needed
+            for key in ['labels', 'tokens', 'token_indices', 'label_indices', 'character_indices_padded', 'character_indices', 'token_lengths', 'characters', 'label_vector_indices']:
+                setattr(dataset, key, {})
+            dataset.update_dataset(dataset_filepaths, list(dataset_filepaths.keys()))
+            token_to_vector = None
+            training_state = None
+        else:
+            dataset = ds.Dataset(verbose=parameters['verbose'], debug=parameters['debug'])
+            token_to_vector = dataset.load_dataset(dataset_filepaths, parameters)
+            training_state = None
         
         # Launch session
         session_conf = tf.ConfigProto(
@@ -270,25 +396,71 @@ class NeuroNER(object):
         allow_soft_placement=True, # automatically choose an existing and supported device to run the operations in case the specified one doesn't exist
         log_device_placement=False
         )
-        sess = tf.Session(config=session_conf)
+        if parameters['number_of_workers'] > 1:
+            # Start the parameter server and the worker processes, and run the chief worker in this session
+            cluster = LocalCluster(dataset, parameters)
+            sess = tf.Session(cluster.target, config=session_conf)
+            device_setter = cluster.device_setter
+        else:
+            cluster = None
+            sess = tf.Session(config=session_conf)
+            device_setter = None
         
-        with sess.as_default():
+        with sess.as_default(), tf.device(device_setter):
             # Create model and initialize or load pretrained model
-            ### Instantiate the model
-            model = EntityLSTM(dataset, parameters)
+            ### Instantiate the input pipeline and the model
+            # In prediction mode, only the forward pass of the model is built
+            model_build_start_time = time.time()
+            if parameters['use_frozen_model']:
+                input_pipeline = None
+                model = FrozenEntityLSTM(os.path.join(parameters['pretrained_model_folder'], FROZEN_MODEL_FILENAME))
+            elif parameters['input_pipeline'] == 'tf_data':
+                input_pipeline = InputPipeline(dataset, parameters)
+                model = EntityLSTM(dataset, parameters, input_batch=input_pipeline.next_batch, inference_only=not parameters['train_model'])
+            else:
+                input_pipeline = None
+                model = EntityLSTM(dataset, parameters, inference_only=not parameters['train_model'])
+            model_build_time = time.time() - model_build_start_time
             ### Initialize the model and restore from pretrained model if needed
-            sess.run(tf.global_variables_initializer())
-            if not parameters['use_pretrained_model']:
+            # The local variables (e.g. the mask of infrequent tokens) are read at each forward pass, even when they are not loaded
+            sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+            if parameters['train_model']:
+                model.load_infrequent_token_mask(sess, dataset)
+            if parameters['use_frozen_model']:
+                # The frozen model has no variables to initialize or restore
+                self.transition_params_trained = sess.run(model.transition_parameters)
+            elif training_state is not None:
+                # Restore the latest checkpoint, including the optimizer slots and the global step
+                print('Resuming the training from {0}'.format(training_state['checkpoint_path']))
+                model.saver.restore(sess, training_state['checkpoint_path'])
+                self.transition_params_trained = sess.run(model.transition_parameters)
+            elif not parameters['use_pretrained_model']:
                 model.load_pretrained_token_embeddings(sess, dataset, parameters, token_to_vector)
                 self.transition_params_trained = np.random.rand(len(dataset.unique_labels)+2,len(dataset.unique_labels)+2)
             else:
                 self.transition_params_trained = model.restore_from_pretrained_model(parameters, dataset, sess, token_to_vector=token_to_vector)
             del token_to_vector
+            if cluster is not None:
+                cluster.start(sess, model)
+            resident_memory = utils.get_resident_memory()
+            print('Model built in {0:.2f} seconds ({1} graph), resident memory after loading: {2}'.format(
+                model_build_time, 'training' if parameters['train_model'] else 'inference-only',
+                'unknown' if resident_memory is None else '{0:.0f} MB'.format(resident_memory)))
+            if parameters['precompute_character_lstm']:
+                character_lstm_cache = CharacterLSTMCache(sess, model, dataset, cache_size=parameters['character_lstm_cache_size'])
+            else:
+                character_lstm_cache = None
 
         self.dataset = dataset
         self.dataset_brat_folders = dataset_brat_folders
         self.dataset_filepaths = dataset_filepaths
         self.model = model
+        self.input_pipeline = input_pipeline
+        self.cluster = cluster
+        self.character_lstm_cache = character_lstm_cache
+        self.training_state = training_state
+        self.model_build_time = model_build_time
+        self.resident_memory = resident_memory
         self.parameters = parameters
         self.conf_parameters = conf_parameters
         self.sess = sess
@@ -301,20 +473,33 @@ class NeuroNER(object):
         dataset_brat_folders = self.dataset_brat_folders
         sess = self.sess
         model = self.model
-        transition_params_trained = self.transition_params_trained
-        stats_graph_folder, experiment_timestamp = self._create_stats_graph_folder(parameters)
+        input_pipeline = self.input_pipeline
+        cluster = self.cluster
+        training_state = self.training_state
+        if training_state is not None:
+            stats_graph_folder = parameters['resume_training_folder']
+        else:
+            stats_graph_folder, experiment_timestamp = self._create_stats_graph_folder(parameters)
 
         # Initialize and save execution details
         start_time = time.time()
-        results = {}
-        results['epoch'] = {}
-        results['execution_details'] = {}
-        results['execution_details']['train_start'] = start_time
-        results['execution_details']['time_stamp'] = experiment_timestamp
+        if training_state is not None:
+            # Continue the results of the interrupted training
+            results = training_state['results']
+        else:
+            results = {}
+            results['epoch'] = {}
+            results['execution_details'] = {}
+            results['execution_details']['train_start'] = start_time
+            results['execution_details']['time_stamp'] = experiment_timestamp
+            results['execution_details']['num_epochs'] = 0
+            results['model_options'] = copy.copy(parameters)
         results['execution_details']['early_stop'] = False
         results['execution_details']['keyboard_interrupt'] = False
-        results['execution_details']['num_epochs'] = 0
-        results['model_options'] = copy.copy(parameters)
+        results['execution_details']['stop_reason'] = None
+        results['execution_details']['number_of_workers'] = parameters['number_of_workers']
+        results['execution_details']['model_build_time'] = self.model_build_time
+        results['execution_details']['resident_memory'] = self.resident_memory
 
         model_folder = os.path.join(stats_graph_folder, 'model')
         utils.create_folder_if_not_exists(model_folder)
@@ -335,18 +520,20 @@ class NeuroNER(object):
             writers[dataset_type] = tf.summary.FileWriter(tensorboard_log_folders[dataset_type], graph=sess.graph)
         embedding_writer = tf.summary.FileWriter(model_folder) # embedding_writer has to write in model_folder, otherwise TensorBoard won't be able to view embeddings
 
-        embeddings_projector_config = projector.ProjectorConfig()
-        tensorboard_token_embeddings = embeddings_projector_config.embeddings.add()
-        tensorboard_token_embeddings.tensor_name = model.token_embedding_weights.name
         token_list_file_path = os.path.join(model_folder, 'tensorboard_metadata_tokens.tsv')
-        tensorboard_token_embeddings.metadata_path = os.path.relpath(token_list_file_path, '..')
-
-        tensorboard_character_embeddings = embeddings_projector_config.embeddings.add()
-        tensorboard_character_embeddings.tensor_name = model.character_embedding_weights.name
         character_list_file_path = os.path.join(model_folder, 'tensorboard_metadata_characters.tsv')
-        tensorboard_character_embeddings.metadata_path = os.path.relpath(character_list_file_path, '..')
+        if not parameters['use_frozen_model']:
+            # The embeddings of a frozen model are not variables, so they cannot be visualized
+            embeddings_projector_config = projector.ProjectorConfig()
+            tensorboard_token_embeddings = embeddings_projector_config.embeddings.add()
+            tensorboard_token_embeddings.tensor_name = model.token_embedding_weights.name
+            tensorboard_token_embeddings.metadata_path = os.path.relpath(token_list_file_path, '..')
 
-        projector.visualize_embeddings(embedding_writer, embeddings_projector_config)
+            tensorboard_character_embeddings = embeddings_projector_config.embeddings.add()
+            tensorboard_character_embeddings.tensor_name = model.character_embedding_weights.name
+            tensorboard_character_embeddings.metadata_path = os.path.relpath(character_list_file_path, '..')
+
+            projector.visualize_embeddings(embedding_writer, embeddings_projector_config)
 
         # Write metadata for TensorBoard embeddings
         token_list_file = codecs.open(token_list_file_path,'w', 'UTF-8')
@@ -367,6 +554,33 @@ class NeuroNER(object):
         bad_counter = 0 # number of epochs with no improvement on the validation test in terms of F1-score
         previous_best_valid_f1_score = 0
         epoch_number = -1
+        best_epoch_number = -1
+        # Wall-clock training budget in seconds (0 means no budget)
+        training_time_budget = parameters['maximum_training_time'] * 60
+        time_budget_reached = False
+        last_evaluated_epoch_number = -1
+        train_evaluation_sequence_numbers = None
+        if parameters['train_model']:
+            train_batch_sampler = sampler.get_batch_sampler(dataset, 'train', parameters)
+            if parameters['use_character_lstm']:
+                # Estimated once, on the batches of an unshuffled epoch, since the shuffling barely changes it
+                token_deduplication_ratio = train.get_token_deduplication_ratio(dataset, 'train', train_batch_sampler.get_batches(shuffle=False))
+                print('Token deduplication: the character LSTM runs on {0:.2f}% of the tokens'.format(token_deduplication_ratio*100))
+            checkpoint_writer = CheckpointWriter(model_folder, parameters['number_of_checkpoints_to_keep'])
+            number_of_train_sequences = len(dataset.token_indices['train'])
+            if 0 < parameters['train_evaluation_sample_size'] < number_of_train_sequences:
+                # The subsample of the train set is drawn with its own seed, so that it is the same at each evaluation (and after resuming the training)
+                train_evaluation_sequence_numbers = sorted(random.Random(0).sample(range(number_of_train_sequences), parameters['train_evaluation_sample_size']))
+        if training_state is not None:
+            # Continue the training loop after the epoch of the latest checkpoint
+            epoch_number = training_state['epoch_number']
+            bad_counter = training_state['bad_counter']
+            previous_best_valid_f1_score = training_state['previous_best_valid_f1_score']
+            best_epoch_number = training_state['best_epoch_number']
+            last_evaluated_epoch_number = epoch_number
+            random.setstate(training_state['python_random_state'])
+            np.random.set_state(training_state['numpy_random_state'])
+            checkpoint_writer.checkpoints = training_state['checkpoints']
         try:
             while True:
                 step = 0
@@ -376,29 +590,80 @@ class NeuroNER(object):
                 epoch_start_time = time.time()
 
                 if epoch_number != 0:
-                    # Train model: loop over all sequences of training set with shuffling
-                    sequence_numbers=list(range(len(dataset.token_indices['train'])))
-                    random.shuffle(sequence_numbers)
-                    for sequence_number in sequence_numbers:
-                        transition_params_trained = train.train_step(sess, dataset, sequence_number, model, parameters)
+                    # Train model: loop over all batches of the training set with shuffling
+                    batches = train_batch_sampler.get_batches(shuffle=True)
+                    if cluster is not None:
+                        # Each worker trains on its own shard of the batches, and the chief on the first one
+                        shards = cluster.distribute_batches(batches)
+                        batches = shards[0]
+                    else:
+                        shards = [batches]
+                    if input_pipeline is not None:
+                        input_pipeline.initialize(sess, 'train', batches)
+                    for sequence_numbers in batches:
+                        stop = training_time_budget > 0 and time.time() - start_time >= training_time_budget
+                        if cluster is not None:
+                            stop = cluster.synchronize_step(stop)
+                        if stop:
+                            print('\nThe training time budget of {0} minutes has been reached after {1} of {2} batches'.format(parameters['maximum_training_time'], step, len(batches)))
+                            time_budget_reached = True
+                            break
                         step += 1
-                        if step % 10 == 0:
-                            print('Training {0:.2f}% done'.format(step/len(sequence_numbers)*100), end='\r', flush=True)
+                        # Fetch the loss and accuracy only every training_log_frequency steps
+                        log_step = parameters['training_log_frequency'] > 0 and step % parameters['training_log_frequency'] == 0
+                        step_output = train.train_step(sess, dataset, sequence_numbers, model, parameters, input_pipeline=input_pipeline, fetch_loss=log_step)
+                        if log_step:
+                            loss, accuracy = step_output
+                            print('Training {0:.2f}% done (loss: {1:.4f}, accuracy: {2:.4f})'.format(step/len(batches)*100, loss, accuracy), end='\r', flush=True)
+                    if cluster is not None:
+                        cluster.wait_for_workers()
+                    print('Padding waste: {0:.2f}% of the padded token positions in {1} batches'.format(train_batch_sampler.padding_waste*100, len(batches)))
 
                 epoch_elapsed_training_time = time.time() - epoch_start_time
                 print('Training completed in {0:.2f} seconds'.format(epoch_elapsed_training_time), flush=True)
-
-                y_pred, y_true, output_filepaths = train.predict_labels(sess, model, transition_params_trained, parameters, dataset, epoch_number, stats_graph_folder, dataset_filepaths)
-
-                # Evaluate model: save and plot results
-                evaluate.evaluate_model(results, dataset, y_pred, y_true, stats_graph_folder, epoch_number, epoch_start_time, output_filepaths, parameters)
-
-                if parameters['use_pretrained_model'] and not parameters['train_model']:
+                if epoch_number != 0:
+                    number_of_trained_sequences = sum(len(sequence_numbers) for shard in shards for sequence_numbers in shard[:step])
+                    training_throughput = number_of_trained_sequences / epoch_elapsed_training_time
+                    print('Training throughput: {0:.1f} sentences per second with {1} worker(s)'.format(training_throughput, parameters['number_of_workers']))
+
+                if not parameters['train_model']:
+                    y_pred, y_true, output_filepaths = train.predict_labels(sess, model, parameters, dataset, epoch_number, stats_graph_folder,
+                                                                            dataset_filepaths, input_pipeline=input_pipeline, character_lstm_cache=self.character_lstm_cache)
+                    evaluate.evaluate_model(results, dataset, y_pred, y_true, stats_graph_folder, epoch_number, epoch_start_time, output_filepaths, parameters)
                     conll_to_brat.output_brat(output_filepaths, dataset_brat_folders, stats_graph_folder)
+                    if parameters['stream_deploy']:
+                        self._predict_deploy_stream(stats_graph_folder)
                     break
 
-                # Save model
-                model.saver.save(sess, os.path.join(model_folder, 'model_{0:05d}.ckpt'.format(epoch_number)))
+                # Evaluate the model on the validation set every validation_frequency epochs, and after the last epoch
+                last_epoch = epoch_number >= parameters['maximum_number_of_epochs'] or time_budget_reached or \
+                             (training_time_budget > 0 and time.time() - start_time >= training_time_budget)
+                if epoch_number % parameters['validation_frequency'] != 0 and not last_epoch:
+                    continue
+
+                # Evaluate model on the validation set, and on a subsample of the train set: save and plot results
+                evaluation_dataset_types = ['valid']
+                if parameters['train_evaluation_sample_size'] != 0:
+                    evaluation_dataset_types.insert(0, 'train')
+                y_pred, y_true, output_filepaths = train.predict_labels(sess, model, parameters, dataset, epoch_number, stats_graph_folder,
+                                                                        dataset_filepaths, input_pipeline=input_pipeline, dataset_types=evaluation_dataset_types,
+                                                                        sequence_numbers={'train': train_evaluation_sequence_numbers})
+                evaluate.evaluate_model(results, dataset, y_pred, y_true, stats_graph_folder, epoch_number, epoch_start_time, output_filepaths, parameters)
+                valid_f1_score = results['epoch'][epoch_number][0]['valid']['f1_score']['micro']
+                if valid_f1_score > previous_best_valid_f1_score:
+                    # Evaluate the model on the test set and predict the deployment set only when the model improves on the validation set
+                    prediction_dataset_types = [dataset_type for dataset_type in ['test', 'deploy'] if dataset_type in dataset_filepaths]
+                    if len(prediction_dataset_types) > 0:
+                        prediction_output = train.predict_labels(sess, model, parameters, dataset, epoch_number, stats_graph_folder,
+                                                                 dataset_filepaths, input_pipeline=input_pipeline, dataset_types=prediction_dataset_types)
+                        evaluate.evaluate_model(results, dataset, prediction_output[0], prediction_output[1], stats_graph_folder, epoch_number, epoch_start_time,
+                                                prediction_output[2], parameters)
+                        output_filepaths.update(prediction_output[2])
+                if epoch_number != 0:
+                    results['epoch'][epoch_number][0]['padding_waste'] = train_batch_sampler.padding_waste
+                    results['epoch'][epoch_number][0]['training_throughput'] = training_throughput
+                    if parameters['use_character_lstm']:
+                        results['epoch'][epoch_number][0]['token_deduplication_ratio'] = token_deduplication_ratio
 
                 # Save TensorBoard logs
                 summary = sess.run(model.summary_op, feed_dict=None)
@@ -407,29 +672,60 @@ class NeuroNER(object):
                 utils.copytree(writers['train'].get_logdir(), model_folder)
 
 
-                # Early stop
-                valid_f1_score = results['epoch'][epoch_number][0]['valid']['f1_score']['micro']
+                # Early stop: bad_counter counts the epochs (not the evaluations) since the last improvement
+                bad_counter += epoch_number - last_evaluated_epoch_number
+                last_evaluated_epoch_number = epoch_number
                 if  valid_f1_score > previous_best_valid_f1_score:
                     bad_counter = 0
                     previous_best_valid_f1_score = valid_f1_score
+                    best_epoch_number = epoch_number
+                    if train_evaluation_sequence_numbers is not None:
+                        # The predictions on a subsample of the train set do not cover the train documents
+                        del output_filepaths['train']
                     conll_to_brat.output_brat(output_filepaths, dataset_brat_folders, stats_graph_folder, overwrite=True)
-                    self.transition_params_trained = transition_params_trained
-                else:
-                    bad_counter += 1
+                    self.transition_params_trained = sess.run(model.transition_parameters)
                 print("The last {0} epochs have not shown improvements on the validation set.".format(bad_counter))
 
+                # Save model in the background, with the state of the training loop needed to resume the training after this epoch
+                training_state = {'epoch_number': epoch_number,
+                                  'bad_counter': bad_counter,
+                                  'previous_best_valid_f1_score': previous_best_valid_f1_score,
+                                  'best_epoch_number': best_epoch_number,
+                                  'results': copy.deepcopy(results),
+                                  'python_random_state': random.getstate(),
+                                  'numpy_random_state': np.random.get_state()}
+                checkpoint_writer.save(sess, epoch_number, valid_f1_score, training_state=training_state)
+
+                if time_budget_reached or (training_time_budget > 0 and time.time() - start_time >= training_time_budget):
+                    print('Stopping the training: the training time budget has been reached')
+                    results['execution_details']['stop_reason'] = 'maximum_training_time'
+                    break
+
                 if bad_counter >= parameters['patience']:
                     print('Early Stop!')
                     results['execution_details']['early_stop'] = True
+                    results['execution_details']['stop_reason'] = 'patience'
                     break
 
-                if epoch_number >= parameters['maximum_number_of_epochs']: break
+                if epoch_number >= parameters['maximum_number_of_epochs']:
+                    results['execution_details']['stop_reason'] = 'maximum_number_of_epochs'
+                    break
 
 
         except KeyboardInterrupt:
             results['execution_details']['keyboard_interrupt'] = True
+            results['execution_details']['stop_reason'] = 'keyboard_interrupt'
             print('Training interrupted')
 
+        if best_epoch_number >= 0:
+            # The checkpoint writer always keeps the checkpoint with the best F1-score on the validation set
+            results['execution_details']['best_epoch'] = best_epoch_number
+            results['execution_details']['best_model_checkpoint'] = os.path.join(model_folder, 'model_{0:05d}.ckpt'.format(best_epoch_number))
+            print('Best model on the validation set: epoch {0} (F1-score: {1:.2f})'.format(best_epoch_number, previous_best_valid_f1_score))
+        if cluster is not None:
+            cluster.stop()
+        if parameters['train_model']:
+            checkpoint_writer.wait()
         print('Finishing the experiment')
         end_time = time.time()
         results['execution_details']['train_duration'] = end_time - start_time
@@ -438,47 +734,104 @@ class NeuroNER(object):
         for dataset_type in dataset_filepaths.keys():
             writers[dataset_type].close()
 
+    def _get_sentences_and_tokens_of_texts(self, texts):
+        sentences_of_texts = brat_to_conll.get_sentences_and_tokens_of_texts(texts, self.parameters['tokenizer'], self._get_tokenizer_model(self.parameters))
+        # Sentences made only of whitespace have no tokens
+        return [[sentence for sentence in sentences if len(sentence) > 0] for sentences in sentences_of_texts]
+
     def predict(self, text):
-        self.prediction_count += 1        
-        
-        if self.prediction_count == 1:
-            self.parameters['dataset_text_folder'] = os.path.join('..', 'data', 'temp')
-            self.stats_graph_folder, _ = self._create_stats_graph_folder(self.parameters)
-        
-        # Update the deploy folder, file, and dataset 
+        '''
+        Predict the entities of text, in memory: the text is tokenized, indexed with the mappings of the dataset, labeled by the model,
+        and the entities are built from the labels, without writing any file.
+        Return the entities in the same format as brat_to_conll.get_entities_from_brat, i.e. a list of dictionaries with id, type, start, end and text.
+        '''
+        return self.predict_batch([text])[0]
+
+    def predict_batch(self, texts, batch_size=None):
+        '''
+        Predict the entities of each text of texts, as predict does, but for all the texts at once: the texts are tokenized together,
+        and their sentences are sorted by length and run through the model in padded batches of batch_size sentences
+        (parameters['batch_size'] if batch_size is None).
+        If parameters['batch_token_budget'] > 0, it takes precedence over batch_size and the sorting by length: the sentences are
+        bucketed by length into batches of at most batch_token_budget tokens, as in training.
+        Return the lists of entities of the texts, in the order of texts.
+        '''
+        self.prediction_count += len(texts)
+        sentences_of_texts = self._get_sentences_and_tokens_of_texts(texts)
+        sentences = [sentence for sentences in sentences_of_texts for sentence in sentences]
+        if len(sentences) == 0:
+            return [[] for _ in texts]
         dataset_type = 'deploy'
-        ### Delete all deployment data    
-        for filepath in glob.glob(os.path.join(self.parameters['dataset_text_folder'], '{0}*'.format(dataset_type))):
-            if os.path.isdir(filepath): 
-                shutil.rmtree(filepath)
-            else:
-                os.remove(filepath)
-        ### Create brat folder and file
-        dataset_brat_deploy_folder = os.path.join(self.parameters['dataset_text_folder'], dataset_type)
-        utils.create_folder_if_not_exists(dataset_brat_deploy_folder)
-        dataset_brat_deploy_filepath = os.path.join(dataset_brat_deploy_folder, 'temp_{0}.txt'.format(str(self.prediction_count).zfill(5)))#self._get_dataset_brat_deploy_filepath(dataset_brat_deploy_folder) 
-        with codecs.open(dataset_brat_deploy_filepath, 'w', 'UTF-8') as f:
-            f.write(text)
-        ### Update deploy filepaths
-        dataset_filepaths, dataset_brat_folders = self._get_valid_dataset_filepaths(self.parameters, dataset_types=[dataset_type])
-        self.dataset_filepaths.update(dataset_filepaths)
-        self.dataset_brat_folders.update(dataset_brat_folders)        
-        ### Update the dataset for the new deploy set
-        self.dataset.update_dataset(self.dataset_filepaths, [dataset_type])
-        
-        # Predict labels and output brat
-        output_filepaths = {}
-        prediction_output = train.prediction_step(self.sess, self.dataset, dataset_type, self.model, self.transition_params_trained, self.stats_graph_folder, self.prediction_count, self.parameters, self.dataset_filepaths)
-        _, _, output_filepaths[dataset_type] = prediction_output
-        conll_to_brat.output_brat(output_filepaths, self.dataset_brat_folders, self.stats_graph_folder, overwrite=True)
-        
-        # Print and output result
-        text_filepath = os.path.join(self.stats_graph_folder, 'brat', 'deploy', os.path.basename(dataset_brat_deploy_filepath))
-        annotation_filepath = os.path.join(self.stats_graph_folder, 'brat', 'deploy', '{0}.ann'.format(utils.get_basename_without_extension(dataset_brat_deploy_filepath)))
-        text2, entities = brat_to_conll.get_entities_from_brat(text_filepath, annotation_filepath, verbose=True)
-        assert(text == text2)
-        return entities
-    
+        self.dataset.update_dataset_from_tokens([[token['text'] for token in sentence] for sentence in sentences], dataset_type)
+        predictions_per_sequence = train.predict_sequences(self.sess, self.dataset, dataset_type, self.model, self.parameters,
+                                                           input_pipeline=self.input_pipeline, character_lstm_cache=self.character_lstm_cache,
+                                                           batch_size=batch_size, sort_by_length=True)
+        entities_of_texts = []
+        sequence_number = 0
+        for text, sentences in zip(texts, sentences_of_texts):
+            labels = []
+            for _ in sentences:
+                sentence_labels = [self.dataset.index_to_label[prediction] for prediction in predictions_per_sequence[sequence_number]]
+                if self.parameters['tagging_format'] == 'bioes':
+                    sentence_labels = utils_nlp.bioes_to_bio(sentence_labels)
+                labels.append(sentence_labels)
+                sequence_number += 1
+            entities_of_texts.append(conll_to_brat.get_entities_from_bio_labels(text, sentences, labels))
+        return entities_of_texts
+
+    def _predict_deploy_stream(self, stats_graph_folder):
+        '''
+        Predict the entities of the documents of the deploy brat folder stream_chunk_size documents at a time, and write the annotation
+        of each document in stats_graph_folder/brat/deploy as soon as its chunk is predicted.
+        '''
+        deploy_brat_folder = os.path.join(self.parameters['dataset_text_folder'], 'deploy')
+        brat_output_folder = os.path.join(stats_graph_folder, 'brat', 'deploy')
+        utils.create_folder_if_not_exists(brat_output_folder)
+        print('Predict labels for the deploy set, {0} documents at a time'.format(self.parameters['stream_chunk_size']))
+        start_time = time.time()
+        number_of_documents = 0
+        with os.scandir(deploy_brat_folder) as entries:
+            # The folder is listed lazily, so that the list of the documents is not held in memory either
+            text_filepaths = (entry.path for entry in entries if entry.is_file() and entry.name.endswith('.txt'))
+            while True:
+                chunk = list(itertools.islice(text_filepaths, self.parameters['stream_chunk_size']))
+                if len(chunk) == 0:
+                    break
+                texts = []
+                for text_filepath in chunk:
+                    with codecs.open(text_filepath, 'r', 'UTF-8') as f:
+                        texts.append(f.read())
+                for text_filepath, entities in zip(chunk, self.predict_batch(texts)):
+                    annotation_filepath = os.path.join(brat_output_folder, '{0}.ann'.format(utils.get_basename_without_extension(text_filepath)))
+                    conll_to_brat.write_brat_annotation(annotation_filepath, entities)
+                    shutil.copy(text_filepath, brat_output_folder)
+                number_of_documents += len(chunk)
+                print('{0} documents predicted ({1:.1f} documents per second)'.format(number_of_documents, number_of_documents / (time.time() - start_time)),
+                      end='\r', flush=True)
+        print('\nDone.')
+
+    def export_frozen_model(self, output_folder, quantize=False):
+        '''
+        Export the model as a frozen inference graph in output_folder, along with the dataset.pickle and parameters.ini needed to load it.
+        To predict with it, set use_pretrained_model to True, pretrained_model_folder to output_folder and use_frozen_model to True.
+        If quantize is True, the embeddings and the weights of the feedforward layers are quantized to int8, and if the test set exists,
+        the F1-scores of the quantized and float models on it are compared in quantization_report.json.
+        '''
+        if self.parameters['use_frozen_model']:
+            raise ValueError('The model is already frozen.')
+        utils.create_folder_if_not_exists(output_folder)
+        frozen_model_filepath = os.path.join(output_folder, FROZEN_MODEL_FILENAME)
+        frozen_model.export_frozen_model(self.sess, self.dataset, self.parameters, frozen_model_filepath, quantize=quantize)
+        if quantize and 'test' in self.dataset_filepaths:
+            report = frozen_model.get_accuracy_delta(self.sess, self.model, self.dataset, 'test', frozen_model_filepath, self.parameters)
+            print('F1-score on the test set: {0:.2f} (float model), {1:.2f} (quantized model), delta: {2:+.2f}; {3:.2f}% of the predicted labels changed'.format(
+                report['f1_score'], report['frozen_f1_score'], report['f1_score_delta'], report['changed_prediction_ratio'] * 100))
+            with open(os.path.join(output_folder, 'quantization_report.json'), 'w') as f:
+                json.dump(report, f, indent=4, sort_keys=True)
+        with open(os.path.join(output_folder, 'parameters.ini'), 'w') as parameters_file:
+            self.conf_parameters.write(parameters_file)
+        pickle.dump(self.dataset, open(os.path.join(output_folder, 'dataset.pickle'), 'wb'))
+
     def get_params(self):
         return self.parameters
     
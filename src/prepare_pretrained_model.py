@@ -1,17 +1,25 @@
 '''
 This script prepares a pretrained model to be shared without exposing the data used for training.
 '''
+import argparse
 import os
 import pickle
 from pprint import pprint
 import shutil
 import utils
 import main
-from entity_lstm import EntityLSTM
+from entity_lstm import EntityLSTM, bidirectional_LSTM
+from neuroner import NeuroNER
 import tensorflow as tf
 import utils_tf
 from tensorflow.python.tools.inspect_checkpoint import print_tensors_in_checkpoint_file
 import glob
+import re
+import configparser
+import numpy as np
+
+# Names of the optimizer slots that are running averages of the gradients (the other slots are averages or sums of squares)
+FIRST_MOMENT_SLOT_NAMES = ['/Adam']
 
 def trim_dataset_pickle(input_dataset_filepath, output_dataset_filepath=None, delete_token_mappings=False):
     '''
@@ -112,6 +120,127 @@ def prepare_pretrained_model_for_restoring(output_folder_name, epoch_number, mod
             shutil.copyfile(filepath, os.path.join(output_model_folder, os.path.basename(filepath).replace('_' + epoch_number_string, '')))
 
  
+def convert_cifg_weights_to_fused(W, B, forget_bias=1.0):
+    '''
+    Convert the weights W and biases B of a CoupledInputForgetGateLSTMCell, whose gates are ordered as [j, f, o] and whose input gate is 1 - f,
+    into the kernel and bias of the equivalent LSTMBlockFusedCell with the same forget_bias, whose gates are ordered as [i, j, f, o].
+    Since 1 - sigmoid(x) = sigmoid(-x), the input gate is obtained with W_i = -W_f and B_i = -(B_f + forget_bias).
+    '''
+    W_j, W_f, W_o = np.split(W, 3, axis=1)
+    B_j, B_f, B_o = np.split(B, 3)
+    kernel = np.concatenate([-W_f, W_j, W_f, W_o], axis=1)
+    bias = np.concatenate([-(B_f + forget_bias), B_j, B_f, B_o])
+    return kernel, bias
+
+
+def convert_cifg_slot_to_fused(slot, is_first_moment):
+    '''
+    Convert an optimizer slot of W or B of a CoupledInputForgetGateLSTMCell (e.g. the Adam moments).
+    The slot of the input gate is initialized with the one of the forget gate. Since the weights of the input gate are the opposite
+    of those of the forget gate (see convert_cifg_weights_to_fused), so are their gradients: a first moment (a running average of the gradients)
+    is negated, whereas a second moment or an accumulator of squared gradients or updates is copied as is.
+    '''
+    slot_j, slot_f, slot_o = np.split(slot, 3, axis=-1)
+    slot_i = -slot_f if is_first_moment else slot_f
+    return np.concatenate([slot_i, slot_j, slot_f, slot_o], axis=-1)
+
+
+def convert_checkpoint_to_fused_lstm(input_checkpoint_filepath, output_checkpoint_filepath):
+    '''
+    Convert a checkpoint of a model with lstm_cell_type = cifg into the checkpoint of the same model with lstm_cell_type = fused.
+    The other variables are copied as is.
+    '''
+    reader = tf.train.NewCheckpointReader(input_checkpoint_filepath)
+    checkpoint_variable_names = sorted(reader.get_variable_to_shape_map().keys())
+    cifg_pattern = re.compile(r'^(.*)/bidirectional_LSTM/bidirectional_rnn/(fw|bw)/coupled_input_forget_gate_lstm_cell/')
+    lstm_scopes = sorted(set(match.group(1) for match in map(cifg_pattern.match, checkpoint_variable_names) if match is not None))
+    values = {}
+    var_list = {}
+    with tf.Graph().as_default():
+        for lstm_scope in lstm_scopes:
+            print('Converting {0}'.format(lstm_scope))
+            W = reader.get_tensor('{0}/bidirectional_LSTM/bidirectional_rnn/fw/coupled_input_forget_gate_lstm_cell/W_0'.format(lstm_scope))
+            hidden_state_dimension = W.shape[1] // 3
+            # Build the fused bidirectional LSTM in the same scope as in EntityLSTM, in order to get the names of its variables
+            with tf.variable_scope(lstm_scope):
+                bidirectional_LSTM(tf.zeros([1, 1, W.shape[0] - hidden_state_dimension]), hidden_state_dimension, tf.contrib.layers.xavier_initializer(),
+                                   cell_type='fused')
+            for direction, cifg_direction in [('forward', 'fw'), ('backward', 'bw')]:
+                cifg_prefix = '{0}/bidirectional_LSTM/bidirectional_rnn/{1}/coupled_input_forget_gate_lstm_cell/'.format(lstm_scope, cifg_direction)
+                kernel, bias = convert_cifg_weights_to_fused(reader.get_tensor(cifg_prefix + 'W_0'), reader.get_tensor(cifg_prefix + 'B'))
+                for variable in tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES, scope='{0}/bidirectional_LSTM/{1}/'.format(lstm_scope, direction)):
+                    name = variable.op.name
+                    var_list[name] = variable
+                    if name.endswith('initial_cell_state') or name.endswith('initial_output_state'):
+                        values[name] = reader.get_tensor(name)
+                        continue
+                    if len(variable.get_shape()) == 2:
+                        values[name] = kernel
+                        cifg_name = cifg_prefix + 'W_0'
+                    else:
+                        values[name] = bias
+                        cifg_name = cifg_prefix + 'B'
+                    # Optimizer slots, e.g. W_0/Adam (first moment) and W_0/Adam_1 (second moment)
+                    for checkpoint_variable_name in checkpoint_variable_names:
+                        if checkpoint_variable_name.startswith(cifg_name + '/'):
+                            slot_name = checkpoint_variable_name[len(cifg_name):]
+                            values[name + slot_name] = convert_cifg_slot_to_fused(reader.get_tensor(checkpoint_variable_name),
+                                                                                  is_first_moment=slot_name in FIRST_MOMENT_SLOT_NAMES)
+
+        # Copy the other variables
+        for name in checkpoint_variable_names:
+            if cifg_pattern.match(name) is None and name not in values:
+                values[name] = reader.get_tensor(name)
+        for name, value in values.items():
+            if name not in var_list:
+                var_list[name] = tf.Variable(tf.zeros(value.shape, dtype=tf.as_dtype(value.dtype)), name='converted_variable')
+
+        saver = tf.train.Saver(var_list=var_list)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            for name, variable in var_list.items():
+                variable.load(values[name], sess)
+            saver.save(sess, output_checkpoint_filepath)
+
+
+def convert_pretrained_model_to_fused_lstm(input_model_folder, output_model_folder):
+    '''
+    Convert a pretrained model trained with lstm_cell_type = cifg (e.g. the models in trained_models) so that it can be used with the
+    faster lstm_cell_type = fused. The converted model computes the same predictions as the original one (up to rounding errors).
+    '''
+    utils.create_folder_if_not_exists(output_model_folder)
+    shutil.copy(os.path.join(input_model_folder, 'dataset.pickle'), output_model_folder)
+
+    # The lstm_cell_type of the pretrained model is used when the model is restored
+    conf_parameters = configparser.ConfigParser()
+    conf_parameters.read(os.path.join(input_model_folder, 'parameters.ini'))
+    if not conf_parameters.has_section('ann'):
+        conf_parameters.add_section('ann')
+    conf_parameters.set('ann', 'lstm_cell_type', 'fused')
+    with open(os.path.join(output_model_folder, 'parameters.ini'), 'w') as parameters_file:
+        conf_parameters.write(parameters_file)
+
+    convert_checkpoint_to_fused_lstm(os.path.join(input_model_folder, 'model.ckpt'), os.path.join(output_model_folder, 'model.ckpt'))
+
+
+def export_frozen_model(model_folder, output_folder, quantize=False, dataset_text_folder=None):
+    '''
+    Export the pretrained model of model_folder (dataset.pickle, parameters.ini and model.ckpt) as a frozen inference graph in output_folder,
+    see NeuroNER.export_frozen_model. The dataset of dataset_text_folder (by default, the one of the parameters.ini of model_folder) is loaded
+    with the model, and if it has a test set, the quantized model is evaluated on it.
+    '''
+    arguments = {'parameters_filepath': os.path.join(model_folder, 'parameters.ini'),
+                 'pretrained_model_folder': model_folder,
+                 'use_pretrained_model': True,
+                 'use_frozen_model': False,
+                 'train_model': False}
+    if dataset_text_folder is not None:
+        arguments['dataset_text_folder'] = dataset_text_folder
+    nn = NeuroNER(**arguments)
+    nn.export_frozen_model(output_folder, quantize=quantize)
+    nn.close()
+
+
 def check_contents_of_dataset_and_model_checkpoint(model_folder):
     '''
     Check the contents of dataset.pickle and model_xxx.ckpt.
@@ -128,13 +257,35 @@ def check_contents_of_dataset_and_model_checkpoint(model_folder):
         print_tensors_in_checkpoint_file(checkpoint_filepath, tensor_name='token_embedding/token_embedding_weights', all_tensors=False)
 
 
+def parse_arguments(arguments=None):
+    parser = argparse.ArgumentParser(description='''Prepare a pretrained model for sharing or deployment''')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+    parser_prepare = subparsers.add_parser('prepare', help='Copy a trained model to trained_models, without the data used for training')
+    parser_prepare.add_argument('--output_folder_name', required=False, default='en_2017-05-05_08-58-32-633799', help='The folder of the training in ../output')
+    parser_prepare.add_argument('--epoch_number', required=False, default=30, type=int, help='The epoch of the checkpoint to copy')
+    parser_prepare.add_argument('--model_name', required=False, default='conll_2003_en', help='The name of the model in ../trained_models')
+    parser_prepare.add_argument('--delete_token_mappings', action='store_true', help='Also delete the token mappings and their embeddings')
+    parser_convert = subparsers.add_parser('convert_to_fused_lstm', help='Convert a pretrained model with lstm_cell_type = cifg to lstm_cell_type = fused')
+    parser_convert.add_argument('--input_model_folder', required=True, help='The folder of the pretrained model')
+    parser_convert.add_argument('--output_model_folder', required=True, help='The folder of the converted model')
+    parser_export = subparsers.add_parser('export_frozen_model', help='Export a pretrained model as a frozen inference graph')
+    parser_export.add_argument('--model_folder', required=True, help='The folder of the pretrained model')
+    parser_export.add_argument('--output_folder', required=True, help='The folder of the frozen model')
+    parser_export.add_argument('--quantize', action='store_true', help='Quantize the embeddings and the weights of the feedforward layers to int8')
+    parser_export.add_argument('--dataset_text_folder', required=False, default=None, help='The dataset to load with the model')
+    return parser.parse_args(args=arguments)
+
+
 if __name__ == '__main__':
-    output_folder_name = 'en_2017-05-05_08-58-32-633799'
-    epoch_number = 30
-    model_name = 'conll_2003_en'
-    delete_token_mappings = False
-    prepare_pretrained_model_for_restoring(output_folder_name, epoch_number, model_name, delete_token_mappings)
-    
+    arguments = parse_arguments()
+    if arguments.command == 'prepare':
+        prepare_pretrained_model_for_restoring(arguments.output_folder_name, arguments.epoch_number, arguments.model_name, arguments.delete_token_mappings)
+    elif arguments.command == 'convert_to_fused_lstm':
+        convert_pretrained_model_to_fused_lstm(arguments.input_model_folder, arguments.output_model_folder)
+    elif arguments.command == 'export_frozen_model':
+        export_frozen_model(arguments.model_folder, arguments.output_folder, quantize=arguments.quantize, dataset_text_folder=arguments.dataset_text_folder)
+
 #     model_name = 'mimic_glove_spacy_iobes'
 #     model_folder = os.path.join('..', 'trained_models', model_name)
-#     check_contents_of_dataset_and_model_checkpoint(model_folder)
\ No newline at end of file
+#     check_contents_of_dataset_and_model_checkpoint(model_folder)
@@ -0,0 +1,107 @@
+'''
+Batch samplers that group sentences of similar length together in order to reduce padding
+'''
+import bisect
+import collections
+import random
+
+
+class BucketBatchSampler(object):
+    """
+    Split the sequences of a dataset split into batches.
+
+    If batch_token_budget is positive, the sequences are bucketed by length, and each batch is filled with sequences from a single bucket
+    as long as the padded size of the batch (number of sequences * length of the longest sequence) stays within batch_token_budget.
+    Otherwise, each batch contains batch_size sequences drawn uniformly, or of similar length if sort_by_length is True.
+    """
+    def __init__(self, sequence_lengths, batch_size=1, batch_token_budget=0, bucket_boundaries=None, sequence_numbers=None, sort_by_length=False):
+        '''
+        sequence_lengths: number of tokens in each sequence
+        sequence_numbers: numbers of the sequences returned in the batches (by default, their positions in sequence_lengths)
+        bucket_boundaries: sorted list of lengths that delimit the buckets: bucket k contains the sequences whose length is in
+                           [bucket_boundaries[k-1], bucket_boundaries[k]). If empty, each distinct length gets its own bucket.
+        '''
+        self.sequence_lengths = sequence_lengths
+        if sequence_numbers is None:
+            sequence_numbers = list(range(len(sequence_lengths)))
+        self.sequence_numbers = sequence_numbers
+        self.batch_size = batch_size
+        self.batch_token_budget = batch_token_budget
+        self.sort_by_length = sort_by_length
+        if not bucket_boundaries:
+            bucket_boundaries = set(sequence_lengths)
+        self.bucket_boundaries = sorted(bucket_boundaries)
+        self.buckets = collections.defaultdict(list)
+        for sequence_number, sequence_length in enumerate(sequence_lengths):
+            self.buckets[bisect.bisect_right(self.bucket_boundaries, sequence_length)].append(sequence_number)
+        self.padding_waste = 0.
+
+    def get_batches(self, shuffle=True):
+        '''
+        Return the list of batches (lists of sequence numbers) for one epoch.
+        If shuffle is True, the sequences are shuffled within each bucket and the batches are shuffled across buckets.
+        '''
+        batches = []
+        if self.batch_token_budget <= 0:
+            sequence_numbers = list(range(len(self.sequence_lengths)))
+            if shuffle:
+                random.shuffle(sequence_numbers)
+            if self.sort_by_length:
+                # The sort is stable, so the sequences of the same length keep their (shuffled) order
+                sequence_numbers.sort(key=lambda sequence_number: self.sequence_lengths[sequence_number])
+            for batch_start in range(0, len(sequence_numbers), self.batch_size):
+                batches.append(sequence_numbers[batch_start:batch_start + self.batch_size])
+        else:
+            for bucket in sorted(self.buckets.keys()):
+                sequence_numbers = list(self.buckets[bucket])
+                if shuffle:
+                    random.shuffle(sequence_numbers)
+                batch = []
+                max_sequence_length = 0
+                for sequence_number in sequence_numbers:
+                    new_max_sequence_length = max(max_sequence_length, self.sequence_lengths[sequence_number])
+                    # A sequence longer than the budget gets a batch of its own
+                    if len(batch) > 0 and (len(batch) + 1) * new_max_sequence_length > self.batch_token_budget:
+                        batches.append(batch)
+                        batch = []
+                        new_max_sequence_length = self.sequence_lengths[sequence_number]
+                    batch.append(sequence_number)
+                    max_sequence_length = new_max_sequence_length
+                if len(batch) > 0:
+                    batches.append(batch)
+            if shuffle:
+                random.shuffle(batches)
+        self.padding_waste = self.compute_padding_waste(batches)
+        return [[self.sequence_numbers[sequence_number] for sequence_number in batch] for batch in batches]
+
+    def compute_padding_waste(self, batches):
+        '''
+        Fraction of the padded token positions that do not correspond to any token.
+        batches contain the positions of the sequences in sequence_lengths.
+        '''
+        number_of_tokens = 0
+        number_of_padded_tokens = 0
+        for batch in batches:
+            sequence_lengths = [self.sequence_lengths[sequence_number] for sequence_number in batch]
+            number_of_tokens += sum(sequence_lengths)
+            number_of_padded_tokens += len(batch) * max(sequence_lengths)
+        if number_of_padded_tokens == 0:
+            return 0.
+        return 1 - number_of_tokens / number_of_padded_tokens
+
+
+def get_batch_sampler(dataset, dataset_type, parameters, sequence_numbers=None, batch_size=None, sort_by_length=False):
+    '''
+    Create the batch sampler of dataset_type according to the batch_size, batch_token_budget and bucket_boundaries parameters.
+    bucket_boundaries is a space-separated list of sequence lengths.
+    If sequence_numbers is given, only these sequences of dataset_type are batched.
+    If batch_size is given, it is used instead of the batch_size parameter.
+    '''
+    if sequence_numbers is None:
+        sequence_numbers = list(range(len(dataset.token_indices[dataset_type])))
+    sequence_lengths = [len(dataset.token_indices[dataset_type][sequence_number]) for sequence_number in sequence_numbers]
+    bucket_boundaries = [int(bucket_boundary) for bucket_boundary in str(parameters['bucket_boundaries']).split()]
+    if batch_size is None:
+        batch_size = parameters['batch_size']
+    return BucketBatchSampler(sequence_lengths, batch_size=batch_size, batch_token_budget=parameters['batch_token_budget'],
+                              bucket_boundaries=bucket_boundaries, sequence_numbers=sequence_numbers, sort_by_length=sort_by_length)
@@ -0,0 +1,178 @@
+'''
+HTTP inference server: keeps one loaded NeuroNER model, and predicts the entities of the texts of concurrent requests in micro-batches
+
+Usage (in addition to the arguments of main.py, e.g. --parameters_filepath, --pretrained_model_folder or --dataset_text_folder):
+    python server.py --port 8000 --max_batch_size 32 --max_wait 10
+
+    POST /predict with the JSON body {"text": "..."} returns {"entities": [...]}, where the entities are as returned by NeuroNER.predict
+    GET /metrics returns the latency percentiles (in milliseconds), the queue depth and the batch statistics
+'''
+import argparse
+import collections
+import http.server
+import json
+import math
+import queue
+import socketserver
+import sys
+import threading
+import time
+
+
+class MicroBatcher(object):
+    """
+    Queue the texts to predict, and predict them with model.predict_batch in batches of at most max_batch_size texts.
+
+    A batch is run as soon as it is full, or max_wait seconds after its first text was queued, whichever comes first.
+    The batches are run one at a time by a single worker thread, so the model is never used concurrently.
+    The latencies (from the queuing of a text to its prediction) of the latest number_of_latencies texts are kept for the metrics.
+    """
+    def __init__(self, model, max_batch_size=32, max_wait=0.01, number_of_latencies=10000):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.latencies = collections.deque(maxlen=number_of_latencies)
+        self.number_of_requests = 0
+        self.number_of_batches = 0
+        self.metrics_lock = threading.Lock()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def predict(self, text, timeout=None):
+        '''
+        Queue text, wait for its batch to be predicted, and return its entities.
+        '''
+        request = {'text': text, 'queuing_time': time.time(), 'done': threading.Event(), 'entities': None, 'error': None}
+        self.requests.put(request)
+        if not request['done'].wait(timeout):
+            raise TimeoutError('The prediction did not complete within {0} seconds.'.format(timeout))
+        if request['error'] is not None:
+            raise request['error']
+        return request['entities']
+
+    def _get_batch(self):
+        # Wait for the first request, then for the next ones until the batch is full or the waiting time of the first one has elapsed
+        batch = [self.requests.get()]
+        deadline = batch[0]['queuing_time'] + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining_time = deadline - time.time()
+            try:
+                batch.append(self.requests.get(timeout=remaining_time) if remaining_time > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._get_batch()
+            try:
+                entities_of_texts = self.model.predict_batch([request['text'] for request in batch])
+            except Exception as error:
+                entities_of_texts = [None] * len(batch)
+                for request in batch:
+                    request['error'] = error
+            end_time = time.time()
+            with self.metrics_lock:
+                self.number_of_batches += 1
+                self.number_of_requests += len(batch)
+                for request, entities in zip(batch, entities_of_texts):
+                    request['entities'] = entities
+                    self.latencies.append(end_time - request['queuing_time'])
+            for request in batch:
+                request['done'].set()
+
+    def get_metrics(self):
+        '''
+        Return the 50th and 99th percentiles of the latest latencies in milliseconds, the number of queued texts, and the batch statistics.
+        '''
+        with self.metrics_lock:
+            latencies = sorted(self.latencies)
+            metrics = {'number_of_requests': self.number_of_requests,
+                       'number_of_batches': self.number_of_batches,
+                       'average_batch_size': self.number_of_requests / self.number_of_batches if self.number_of_batches > 0 else 0.}
+        for percentile in [50, 99]:
+            # Nearest-rank percentile
+            metrics['latency_p{0}'.format(percentile)] = latencies[max(0, math.ceil(percentile / 100 * len(latencies)) - 1)] * 1000 if len(latencies) > 0 else None
+        metrics['queue_depth'] = self.requests.qsize()
+        return metrics
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+
+    def _send_json(self, status, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.server.batcher.get_metrics())
+        else:
+            self._send_json(404, {'error': 'Unknown path: {0}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'Unknown path: {0}'.format(self.path)})
+            return
+        try:
+            content = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            text = content['text']
+            if not isinstance(text, str):
+                raise TypeError('text must be a string')
+        except (ValueError, KeyError, TypeError) as error:
+            self._send_json(400, {'error': 'The body must be a JSON object with a text string: {0}'.format(error)})
+            return
+        try:
+            entities = self.server.batcher.predict(text)
+        except Exception as error:
+            self._send_json(500, {'error': str(error)})
+            return
+        self._send_json(200, {'entities': entities})
+
+    def log_message(self, format, *args):
+        # Do not log each request
+        pass
+
+
+class InferenceServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    HTTP server that handles each request in its own thread, and predicts the texts of the requests with a shared MicroBatcher.
+    """
+    daemon_threads = True
+
+    def __init__(self, model, host='localhost', port=8000, max_batch_size=32, max_wait=0.01):
+        self.batcher = MicroBatcher(model, max_batch_size=max_batch_size, max_wait=max_wait)
+        http.server.HTTPServer.__init__(self, (host, port), RequestHandler)
+
+
+def main(argv=sys.argv):
+    # The arguments that are not those of the server are given to NeuroNER
+    parser = argparse.ArgumentParser(description='''NeuroNER inference server''')
+    parser.add_argument('--host', required=False, default='localhost', help='The host name or address to listen on')
+    parser.add_argument('--port', required=False, default=8000, type=int, help='The port to listen on')
+    parser.add_argument('--max_batch_size', required=False, default=32, type=int, help='The maximum number of texts predicted together')
+    parser.add_argument('--max_wait', required=False, default=10., type=float,
+                        help='The maximum time in milliseconds a text waits for other texts to be predicted with')
+    server_arguments, neuroner_arguments = parser.parse_known_args(argv[1:])
+
+    # TensorFlow is only needed to serve a model
+    import main as neuroner_main
+    from neuroner import NeuroNER
+    arguments = neuroner_main.parse_arguments(neuroner_arguments + ['--train_model', 'False', '--use_pretrained_model', 'True'])
+    model = NeuroNER(**arguments)
+    server = InferenceServer(model, host=server_arguments.host, port=server_arguments.port, max_batch_size=server_arguments.max_batch_size,
+                             max_wait=server_arguments.max_wait / 1000)
+    print('Serving on http://{0}:{1}'.format(server_arguments.host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+    model.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+'''
+Tests for conll_to_brat.py
+'''
+
+import codecs
+import os
+import re
+import tempfile
+import unittest
+import conll_to_brat
+
+class TestConllToBrat(unittest.TestCase):
+
+    def setUp(self):
+        self.text = 'John Smith visited New York and Paris .\nBig\nApple rocks'
+        # The second sentence spans a newline, which splits its entity
+        sentence_spans = [(0, self.text.index('\n')), (self.text.index('Big'), len(self.text))]
+        self.sentences = []
+        for sentence_start, sentence_end in sentence_spans:
+            self.sentences.append([{'text': match.group(), 'start': sentence_start + match.start(), 'end': sentence_start + match.end()}
+                                   for match in re.finditer(r'\S+', self.text[sentence_start:sentence_end])])
+        # B-/I- continuation (John Smith), I- after O (New York), I- of another type than the previous label (.), newline inside an entity (Big Apple)
+        self.labels = [['B-PER', 'I-PER', 'O', 'I-LOC', 'I-LOC', 'O', 'B-LOC', 'I-PER'],
+                       ['B-LOC', 'I-LOC', 'O']]
+
+    def get_entities_from_conll_to_brat(self):
+        with tempfile.TemporaryDirectory() as folder:
+            brat_original_folder = os.path.join(folder, 'brat_original')
+            brat_output_folder = os.path.join(folder, 'brat_output')
+            os.makedirs(brat_original_folder)
+            with codecs.open(os.path.join(brat_original_folder, 'text.txt'), 'w', 'UTF-8') as f:
+                f.write(self.text)
+            conll_filepath = os.path.join(folder, 'deploy.txt')
+            with codecs.open(conll_filepath, 'w', 'UTF-8') as f:
+                for sentence, sentence_labels in zip(self.sentences, self.labels):
+                    for token, label in zip(sentence, sentence_labels):
+                        f.write('{0} text {1} {2} {3}\n'.format(token['text'], token['start'], token['end'], label))
+                    f.write('\n')
+            conll_to_brat.conll_to_brat(conll_filepath, conll_filepath, brat_original_folder, brat_output_folder)
+            entities = []
+            with codecs.open(os.path.join(brat_output_folder, 'text.ann'), 'r', 'UTF-8') as f:
+                for line in f.read().splitlines():
+                    entity_id, annotation, entity_text = line.split('\t')
+                    entity_type, start, end = annotation.split(' ')
+                    entities.append({'id': entity_id, 'type': entity_type, 'start': int(start), 'end': int(end), 'text': entity_text})
+        return entities
+
+    def test_get_entities_from_bio_labels_SameAsConllToBrat(self):
+        entities = conll_to_brat.get_entities_from_bio_labels(self.text, self.sentences, self.labels)
+        self.assertEqual(entities, self.get_entities_from_conll_to_brat())
+
+    def test_get_entities_from_bio_labels_Entities(self):
+        entities = conll_to_brat.get_entities_from_bio_labels(self.text, self.sentences, self.labels)
+        self.assertEqual([(entity['id'], entity['type'], entity['text']) for entity in entities],
+                         [('T1', 'PER', 'John Smith'), ('T2', 'LOC', 'New York'), ('T3', 'LOC', 'Paris'), ('T4', 'PER', '.'),
+                          ('T5', 'LOC', 'Big'), ('T6', 'LOC', 'Apple')])
+
+if __name__ == "__main__":
+    unittest.main()
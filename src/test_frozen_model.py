@@ -0,0 +1,51 @@
+'''
+Tests for frozen_model.py
+'''
+
+import unittest
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import tensor_util
+import frozen_model
+
+class TestFrozenModel(unittest.TestCase):
+
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+
+    def test_quantize_rows_ErrorBoundedByHalfScale(self):
+        values = self.random_state.randn(20, 10).astype(np.float32)
+        values[3] = 0
+        quantized, scales = frozen_model.quantize_rows(values)
+        self.assertEqual(quantized.dtype, np.int8)
+        self.assertEqual(scales.shape, (20, 1))
+        self.assertTrue(np.all(np.abs(quantized * scales - values) <= scales / 2 + 1e-6))
+        self.assertTrue(np.all(quantized[3] == 0))
+
+    def test_quantize_graph_def_MatchesFloatGraph(self):
+        ''' The quantized graph must compute the same outputs as the float graph, up to the quantization error'''
+        embedding_values = self.random_state.randn(50, 8).astype(np.float32)
+        dense_values = self.random_state.randn(8, 3).astype(np.float32)
+        with tf.Graph().as_default() as graph:
+            token_indices = tf.placeholder(tf.int32, [None], name='token_indices')
+            embedded_tokens = tf.nn.embedding_lookup(tf.constant(embedding_values), token_indices)
+            tf.identity(tf.matmul(embedded_tokens, tf.constant(dense_values)), name='output')
+            graph_def = graph.as_graph_def()
+        quantized_graph_def = frozen_model.quantize_graph_def(graph_def, {'embedding': embedding_values}, {'W': dense_values}, ['output'])
+        # The float constants are removed
+        constant_shapes = [(tf.as_dtype(node.attr['dtype'].type), tuple(tensor_util.MakeNdarray(node.attr['value'].tensor).shape))
+                           for node in quantized_graph_def.node if node.op == 'Const']
+        self.assertIn((tf.int8, (50, 8)), constant_shapes)
+        self.assertNotIn((tf.float32, (50, 8)), constant_shapes)
+        self.assertNotIn((tf.float32, (8, 3)), constant_shapes)
+        feed_values = self.random_state.randint(0, 50, size=30)
+        outputs = []
+        for graph_def in [graph_def, quantized_graph_def]:
+            with tf.Graph().as_default():
+                tf.import_graph_def(graph_def, name='')
+                with tf.Session() as sess:
+                    outputs.append(sess.run('output:0', {'token_indices:0': feed_values}))
+        np.testing.assert_allclose(outputs[1], outputs[0], atol=0.1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+'''
+Tests for sampler.py
+'''
+
+import random
+import unittest
+import sampler
+
+class TestBucketBatchSampler(unittest.TestCase):
+
+    def setUp(self):
+        self.random_state = random.Random(0)
+        self.sequence_lengths = [self.random_state.randint(1, 40) for _ in range(200)] + [100]
+
+    def test_get_batches_TokenBudget_BatchesWithinBudget(self):
+        batch_sampler = sampler.BucketBatchSampler(self.sequence_lengths, batch_token_budget=120, bucket_boundaries=[5, 10, 20])
+        for shuffle in [False, True]:
+            for batch in batch_sampler.get_batches(shuffle=shuffle):
+                padded_size = len(batch) * max(self.sequence_lengths[sequence_number] for sequence_number in batch)
+                # Only a sequence longer than the budget gets a batch beyond it, on its own
+                self.assertTrue(padded_size <= 120 or len(batch) == 1)
+
+    def test_get_batches_EachSequenceOncePerEpoch(self):
+        for batch_token_budget, sort_by_length in [(120, False), (0, False), (0, True)]:
+            batch_sampler = sampler.BucketBatchSampler(self.sequence_lengths, batch_size=16, batch_token_budget=batch_token_budget, sort_by_length=sort_by_length)
+            for shuffle in [False, True]:
+                sequence_numbers = [sequence_number for batch in batch_sampler.get_batches(shuffle=shuffle) for sequence_number in batch]
+                self.assertEqual(sorted(sequence_numbers), list(range(len(self.sequence_lengths))))
+
+    def test_get_batches_SequenceNumbers_ReturnedInsteadOfPositions(self):
+        batch_sampler = sampler.BucketBatchSampler([3, 1, 2], batch_size=2, sequence_numbers=[10, 20, 30])
+        self.assertEqual(sorted(sum(batch_sampler.get_batches(shuffle=True), [])), [10, 20, 30])
+
+    def test_compute_padding_waste_HandBuiltBatches(self):
+        batch_sampler = sampler.BucketBatchSampler([2, 4, 3, 3, 1])
+        # 13 tokens in 2 * 4 + 2 * 3 + 1 * 1 = 15 padded positions
+        self.assertAlmostEqual(batch_sampler.compute_padding_waste([[0, 1], [2, 3], [4]]), 1 - 13 / 15)
+        self.assertEqual(batch_sampler.compute_padding_waste([[0], [1]]), 0.)
+        self.assertEqual(batch_sampler.compute_padding_waste([]), 0.)
+
+    def test_get_batches_PaddingWasteOfLatestEpoch(self):
+        batch_sampler = sampler.BucketBatchSampler([2, 4, 3, 3, 1], batch_size=2)
+        batches = batch_sampler.get_batches(shuffle=False)
+        self.assertEqual(batches, [[0, 1], [2, 3], [4]])
+        self.assertAlmostEqual(batch_sampler.padding_waste, 1 - 13 / 15)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+'''
+Tests for server.py
+'''
+
+import json
+import threading
+import time
+import unittest
+import urllib.error
+import urllib.request
+import server
+
+class FakeModel(object):
+    ''' Stand-in for NeuroNER: each text is one entity, and the sizes of the batches are recorded'''
+
+    def __init__(self, delay=0.):
+        self.delay = delay
+        self.batch_sizes = []
+
+    def predict_batch(self, texts):
+        self.batch_sizes.append(len(texts))
+        time.sleep(self.delay)
+        if 'error' in texts:
+            raise RuntimeError('fake model error')
+        return [[{'id': 'T1', 'type': 'TEXT', 'start': 0, 'end': len(text), 'text': text}] for text in texts]
+
+class TestServer(unittest.TestCase):
+
+    def start_server(self, model, max_batch_size=4, max_wait=0.2):
+        self.server = server.InferenceServer(model, host='localhost', port=0, max_batch_size=max_batch_size, max_wait=max_wait)
+        self.url = 'http://localhost:{0}'.format(self.server.server_address[1])
+        self.server_thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self, path, body):
+        request = urllib.request.Request(self.url + path, data=body, headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as error:
+            return error.code, json.loads(error.read().decode('utf-8'))
+
+    def predict(self, text):
+        return self.post('/predict', json.dumps({'text': text}).encode('utf-8'))
+
+    def get_metrics(self):
+        with urllib.request.urlopen(self.url + '/metrics') as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def test_predict_ConcurrentRequests_AnsweredInMicroBatches(self):
+        model = FakeModel()
+        self.start_server(model, max_batch_size=4)
+        texts = ['text number {0}'.format(i) for i in range(10)]
+        responses = {}
+        def predict(text):
+            responses[text] = self.predict(text)
+        threads = [threading.Thread(target=predict, args=(text,)) for text in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Each request gets the entities of its own text
+        for text in texts:
+            status, content = responses[text]
+            self.assertEqual(status, 200)
+            self.assertEqual(content['entities'], [{'id': 'T1', 'type': 'TEXT', 'start': 0, 'end': len(text), 'text': text}])
+        self.assertEqual(sum(model.batch_sizes), len(texts))
+        self.assertLessEqual(max(model.batch_sizes), 4)
+        self.assertLess(len(model.batch_sizes), len(texts))
+
+    def test_predict_MaxWait_SingleRequestNotDelayedMuch(self):
+        self.start_server(FakeModel(), max_wait=0.05)
+        start_time = time.time()
+        status, _ = self.predict('alone')
+        self.assertEqual(status, 200)
+        self.assertLess(time.time() - start_time, 1.)
+
+    def test_metrics_AfterRequests_ReportsLatenciesAndQueueDepth(self):
+        self.start_server(FakeModel(), max_wait=0.01)
+        metrics = self.get_metrics()
+        self.assertEqual(metrics['number_of_requests'], 0)
+        self.assertIsNone(metrics['latency_p50'])
+        for i in range(5):
+            self.predict('text {0}'.format(i))
+        metrics = self.get_metrics()
+        self.assertEqual(metrics['number_of_requests'], 5)
+        self.assertEqual(metrics['queue_depth'], 0)
+        self.assertGreater(metrics['latency_p50'], 0)
+        self.assertGreaterEqual(metrics['latency_p99'], metrics['latency_p50'])
+
+    def test_metrics_SlowModel_ReportsQueuedRequests(self):
+        self.start_server(FakeModel(delay=0.5), max_batch_size=1, max_wait=0.)
+        threads = [threading.Thread(target=self.predict, args=('text {0}'.format(i),)) for i in range(3)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        self.assertGreaterEqual(self.get_metrics()['queue_depth'], 1)
+        for thread in threads:
+            thread.join()
+
+    def test_predict_InvalidBody_Returns400(self):
+        self.start_server(FakeModel())
+        status, content = self.post('/predict', b'not json')
+        self.assertEqual(status, 400)
+        status, content = self.post('/predict', json.dumps({'texts': 'a'}).encode('utf-8'))
+        self.assertEqual(status, 400)
+
+    def test_predict_ModelError_Returns500(self):
+        self.start_server(FakeModel(), max_wait=0.)
+        status, content = self.predict('error')
+        self.assertEqual(status, 500)
+        self.assertIn('fake model error', content['error'])
+
+if __name__ == "__main__":
+    unittest.main()
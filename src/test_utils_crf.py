@@ -0,0 +1,66 @@
+'''
+Tests for utils_crf.py
+'''
+
+import itertools
+import unittest
+import numpy as np
+import tensorflow as tf
+import utils_crf
+
+class TestUtilsCrf(unittest.TestCase):
+
+    def setUp(self):
+        self.random_state = np.random.RandomState(0)
+
+    def get_random_batch(self, batch_size=8, max_sequence_length=7, number_of_tags=5):
+        unary_scores = self.random_state.randn(batch_size, max_sequence_length, number_of_tags).astype(np.float32)
+        transition_params = self.random_state.randn(number_of_tags, number_of_tags).astype(np.float32)
+        sequence_lengths = self.random_state.randint(1, max_sequence_length + 1, size=batch_size)
+        sequence_lengths[0] = max_sequence_length
+        return unary_scores, transition_params, sequence_lengths
+
+    def test_viterbi_decode_batch_MatchesViterbiDecode(self):
+        ''' The best path and its score must be exactly those of tf.contrib.crf.viterbi_decode for each sequence'''
+        unary_scores, transition_params, sequence_lengths = self.get_random_batch()
+        # Ties between paths must be broken in the same way
+        unary_scores[1] = np.round(unary_scores[1])
+        transition_params = np.round(transition_params)
+        paths, scores = utils_crf.viterbi_decode_batch(unary_scores, transition_params, sequence_lengths)
+        for b, sequence_length in enumerate(sequence_lengths):
+            expected_path, expected_score = tf.contrib.crf.viterbi_decode(unary_scores[b, :sequence_length], transition_params)
+            self.assertEqual(paths[b, 0, :sequence_length].tolist(), expected_path)
+            self.assertEqual(scores[b, 0], expected_score)
+            self.assertTrue(np.all(paths[b, 0, sequence_length:] == 0))
+
+    def test_viterbi_decode_batch_ReturnsNBestPaths(self):
+        ''' The n-best paths must be the n highest scoring paths found by brute force'''
+        number_of_best_paths = 4
+        unary_scores, transition_params, sequence_lengths = self.get_random_batch(batch_size=4, max_sequence_length=4, number_of_tags=3)
+        paths, scores = utils_crf.viterbi_decode_batch(unary_scores, transition_params, sequence_lengths, number_of_best_paths=number_of_best_paths)
+        for b, sequence_length in enumerate(sequence_lengths):
+            all_scores = []
+            for path in itertools.product(range(unary_scores.shape[2]), repeat=sequence_length):
+                score = unary_scores[b, 0, path[0]] + sum(transition_params[path[t-1], path[t]] + unary_scores[b, t, path[t]] for t in range(1, sequence_length))
+                all_scores.append((score, list(path)))
+            all_scores.sort(key=lambda path_score: -path_score[0])
+            for rank in range(min(number_of_best_paths, len(all_scores))):
+                self.assertAlmostEqual(scores[b, rank], all_scores[rank][0], places=4)
+                path_score = unary_scores[b, 0, paths[b, rank, 0]] + sum(transition_params[paths[b, rank, t-1], paths[b, rank, t]] + unary_scores[b, t, paths[b, rank, t]]
+                                                                         for t in range(1, sequence_length))
+                self.assertAlmostEqual(path_score, scores[b, rank], places=4)
+            for rank in range(len(all_scores), number_of_best_paths):
+                self.assertEqual(scores[b, rank], -np.inf)
+
+    def test_crf_decode_batch_RemovesStartAndEndTags(self):
+        ''' Decoding the scores with start and end tags must match viterbi_decode as used by EntityLSTM'''
+        unary_scores, transition_params, sequence_lengths = self.get_random_batch(number_of_tags=7)
+        unary_scores = utils_crf.add_start_and_end_scores(unary_scores[:, :, :5], sequence_lengths)
+        paths, _ = utils_crf.crf_decode_batch(unary_scores, transition_params, sequence_lengths)
+        self.assertEqual(paths.shape, (8, 1, 7))
+        for b, sequence_length in enumerate(sequence_lengths):
+            expected_path, _ = tf.contrib.crf.viterbi_decode(unary_scores[b, :sequence_length + 2], transition_params)
+            self.assertEqual(paths[b, 0, :sequence_length].tolist(), expected_path[1:-1])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,4 @@
 import os
-import tensorflow as tf
 import numpy as np
 import sklearn.metrics
 from evaluate import remap_labels
@@ -7,28 +6,166 @@ import pickle
 import utils_tf
 import codecs
 import utils_nlp
+import sampler
 #from tensorflow.python.tools.inspect_checkpoint import print_tensors_in_checkpoint_file
 
-def train_step(sess, dataset, sequence_number, model, parameters):
-    # Perform one iteration
-    token_indices_sequence = dataset.token_indices['train'][sequence_number]
-    for i, token_index in enumerate(token_indices_sequence):
-        if token_index in dataset.infrequent_token_indices and np.random.uniform() < 0.5:
-            token_indices_sequence[i] = dataset.UNK_TOKEN_INDEX
+def get_batch(dataset, dataset_type, sequence_numbers):
+    '''
+    Pad the sequences given by sequence_numbers into arrays of shape [batch_size, max_sequence_length].
+    Each distinct token of the batch is given only once to the character LSTM: the characters of the unique tokens are padded to
+    [number_of_unique_tokens, max_token_length], and token_unique_indices maps each token of the batch to its unique token.
+    '''
+    batch_size = len(sequence_numbers)
+    sequence_lengths = np.array([len(dataset.token_indices[dataset_type][sequence_number]) for sequence_number in sequence_numbers], dtype=np.int32)
+    max_sequence_length = max(sequence_lengths)
+    max_token_length = max([max(dataset.token_lengths[dataset_type][sequence_number]) for sequence_number in sequence_numbers])
+    batch = {}
+    batch['sequence_lengths'] = sequence_lengths
+    batch['token_indices'] = np.zeros([batch_size, max_sequence_length], dtype=np.int32)
+    batch['label_indices'] = np.zeros([batch_size, max_sequence_length], dtype=np.int32)
+    batch['label_vector_indices'] = np.zeros([batch_size, max_sequence_length, dataset.number_of_classes], dtype=np.float32)
+    batch['token_unique_indices'] = np.zeros([batch_size, max_sequence_length], dtype=np.int32)
+    unique_token_indices = {}
+    unique_character_indices = []
+    for i, sequence_number in enumerate(sequence_numbers):
+        sequence_length = sequence_lengths[i]
+        batch['token_indices'][i, :sequence_length] = dataset.token_indices[dataset_type][sequence_number]
+        batch['label_indices'][i, :sequence_length] = dataset.label_indices[dataset_type][sequence_number]
+        batch['label_vector_indices'][i, :sequence_length] = dataset.label_vector_indices[dataset_type][sequence_number]
+        for j, character_indices in enumerate(dataset.character_indices[dataset_type][sequence_number]):
+            # Tokens are identified by their characters, since different tokens may be mapped to the same token index (e.g. UNK)
+            key = tuple(character_indices)
+            if key not in unique_token_indices:
+                unique_token_indices[key] = len(unique_character_indices)
+                unique_character_indices.append(character_indices)
+            batch['token_unique_indices'][i, j] = unique_token_indices[key]
+    batch['token_lengths'] = np.array([len(character_indices) for character_indices in unique_character_indices], dtype=np.int32)
+    batch['character_indices'] = np.full([len(unique_character_indices), max_token_length], dataset.PADDING_CHARACTER_INDEX, dtype=np.int32)
+    for k, character_indices in enumerate(unique_character_indices):
+        batch['character_indices'][k, :len(character_indices)] = character_indices
+    return batch
+
+def get_token_deduplication_ratio(dataset, dataset_type, batches):
+    '''
+    Fraction of the tokens of the batches that are given to the character LSTM, once the tokens are deduplicated within each batch (see get_batch).
+    '''
+    number_of_tokens = 0
+    number_of_unique_tokens = 0
+    for sequence_numbers in batches:
+        unique_tokens = set()
+        for sequence_number in sequence_numbers:
+            character_indices = dataset.character_indices[dataset_type][sequence_number]
+            number_of_tokens += len(character_indices)
+            unique_tokens.update(tuple(token_character_indices) for token_character_indices in character_indices)
+        number_of_unique_tokens += len(unique_tokens)
+    if number_of_tokens == 0:
+        return 1.
+    return number_of_unique_tokens / number_of_tokens
+
+def get_feed_dict(model, batch, dropout_keep_prob):
     feed_dict = {
-      model.input_token_indices: token_indices_sequence,
-      model.input_label_indices_vector: dataset.label_vector_indices['train'][sequence_number],
-      model.input_token_character_indices: dataset.character_indices_padded['train'][sequence_number],
-      model.input_token_lengths: dataset.token_lengths['train'][sequence_number],
-      model.input_label_indices_flat: dataset.label_indices['train'][sequence_number],
-      model.dropout_keep_prob: 1-parameters['dropout_rate']
+      model.input_token_indices: batch['token_indices'],
+      model.input_label_indices_vector: batch['label_vector_indices'],
+      model.input_token_character_indices: batch['character_indices'],
+      model.input_token_lengths: batch['token_lengths'],
+      model.input_token_unique_indices: batch['token_unique_indices'],
+      model.input_label_indices_flat: batch['label_indices'],
+      model.input_sequence_lengths: batch['sequence_lengths'],
+      model.dropout_keep_prob: dropout_keep_prob
     }
-    _, _, loss, accuracy, transition_params_trained = sess.run(
-                    [model.train_op, model.global_step, model.loss, model.accuracy, model.transition_parameters],
-                    feed_dict)
-    return transition_params_trained
+    # A frozen model (FrozenEntityLSTM) has no label placeholders
+    return {placeholder: value for placeholder, value in feed_dict.items() if placeholder is not None}
+
+def train_step(sess, dataset, sequence_numbers, model, parameters, input_pipeline=None, fetch_loss=False):
+    '''
+    Perform one iteration on a batch of sequences.
+    With the tf.data input pipeline, the batch is the next one prepared by the pipeline (which follows the same order of batches).
+    Only the training operation is run, unless fetch_loss is True, in which case the loss and accuracy on the batch are returned.
+    '''
+    if input_pipeline is None:
+        batch = get_batch(dataset, 'train', sequence_numbers)
+        feed_dict = get_feed_dict(model, batch, 1-parameters['dropout_rate'])
+    else:
+        feed_dict = {model.dropout_keep_prob: 1-parameters['dropout_rate']}
+    # Replace infrequent tokens with UNK half of the time
+    feed_dict[model.word_dropout_probability] = 0.5
+    if fetch_loss:
+        _, loss, accuracy = sess.run([model.train_op, model.loss, model.accuracy], feed_dict)
+        return loss, accuracy
+    sess.run(model.train_op, feed_dict)
+
+def write_sequence_predictions(dataset, dataset_type, i, predictions, original_conll_file, output_file, parameters):
+    '''
+    Write the predictions for sequence i next to the corresponding lines of the original conll file.
+    '''
+    assert(len(predictions) == len(dataset.tokens[dataset_type][i]))
+    output_string = ''
+    prediction_labels = [dataset.index_to_label[prediction] for prediction in predictions]
+    gold_labels = dataset.labels[dataset_type][i]
+    if parameters['tagging_format'] == 'bioes':
+        prediction_labels = utils_nlp.bioes_to_bio(prediction_labels)
+        gold_labels = utils_nlp.bioes_to_bio(gold_labels)
+    for prediction, token, gold_label in zip(prediction_labels, dataset.tokens[dataset_type][i], gold_labels):
+        while True:
+            line = original_conll_file.readline()
+            split_line = line.strip().split(' ')
+            if '-DOCSTART-' in split_line[0] or len(split_line) == 0 or len(split_line[0]) == 0:
+                continue
+            else:
+                token_original = split_line[0]
+                if parameters['tagging_format'] == 'bioes':
+                    split_line.pop()
+                gold_label_original = split_line[-1]
+                assert(token == token_original and gold_label == gold_label_original) 
+                break            
+        split_line.append(prediction)
+        output_string += ' '.join(split_line) + '\n'
+    output_file.write(output_string+'\n')
+
+def skip_sequence(dataset, dataset_type, i, original_conll_file):
+    '''
+    Skip the lines of sequence i in the original conll file, for the sequences that are not predicted.
+    '''
+    number_of_tokens = len(dataset.tokens[dataset_type][i])
+    while number_of_tokens > 0:
+        split_line = original_conll_file.readline().strip().split(' ')
+        if '-DOCSTART-' in split_line[0] or len(split_line[0]) == 0:
+            continue
+        number_of_tokens -= 1
+
+def predict_sequences(sess, dataset, dataset_type, model, parameters, input_pipeline=None, sequence_numbers=None, character_lstm_cache=None,
+                      batch_size=None, sort_by_length=False):
+    '''
+    Predict the label indices of the sequences of dataset_type (or only of sequence_numbers, if given), batch by batch.
+    batch_size and sort_by_length are passed to sampler.get_batch_sampler.
+    Return a dictionary from the sequence numbers to the lists of predicted label indices.
+    '''
+    batch_sampler = sampler.get_batch_sampler(dataset, dataset_type, parameters, sequence_numbers=sequence_numbers, batch_size=batch_size,
+                                              sort_by_length=sort_by_length)
+    batches = batch_sampler.get_batches(shuffle=False)
+    if input_pipeline is not None:
+        input_pipeline.initialize(sess, dataset_type, batches)
+    predictions_per_sequence = {}
+    for batch in batches:
+        if input_pipeline is None:
+            feed_dict = get_feed_dict(model, get_batch(dataset, dataset_type, batch), 1.)
+        else:
+            feed_dict = {model.dropout_keep_prob: 1.}
+        if character_lstm_cache is not None:
+            feed_dict[model.character_lstm_output] = character_lstm_cache.get_character_lstm_output(sess, dataset_type, batch)
+        # With the CRF, the predictions are decoded in the graph for the whole batch
+        predictions, sequence_lengths = sess.run([model.predictions, model.input_sequence_lengths], feed_dict)
+        for batch_index, i in enumerate(batch):
+            predictions_per_sequence[i] = predictions[batch_index, :sequence_lengths[batch_index]].tolist()
+    return predictions_per_sequence
 
-def prediction_step(sess, dataset, dataset_type, model, transition_params_trained, stats_graph_folder, epoch_number, parameters, dataset_filepaths):
+def prediction_step(sess, dataset, dataset_type, model, stats_graph_folder, epoch_number, parameters, dataset_filepaths, input_pipeline=None,
+                    sequence_numbers=None, character_lstm_cache=None):
+    '''
+    Predict the labels of dataset_type, write them in the output conll file and evaluate them.
+    If sequence_numbers is given, only these sequences are predicted and evaluated.
+    If character_lstm_cache is given, the character LSTM outputs are taken from it instead of being computed by the model.
+    '''
     if dataset_type == 'deploy':
         print('Predict labels for the {0} set'.format(dataset_type))
     else:
@@ -39,46 +176,16 @@ def prediction_step(sess, dataset, dataset_type, model, transition_params_traine
     output_file = codecs.open(output_filepath, 'w', 'UTF-8')
     original_conll_file = codecs.open(dataset_filepaths[dataset_type], 'r', 'UTF-8')
 
+    # Predict batch by batch, then write the predictions in the original order of the sequences
+    predictions_per_sequence = predict_sequences(sess, dataset, dataset_type, model, parameters, input_pipeline=input_pipeline,
+                                                 sequence_numbers=sequence_numbers, character_lstm_cache=character_lstm_cache)
+
     for i in range(len(dataset.token_indices[dataset_type])):
-        feed_dict = {
-          model.input_token_indices: dataset.token_indices[dataset_type][i],
-          model.input_token_character_indices: dataset.character_indices_padded[dataset_type][i],
-          model.input_token_lengths: dataset.token_lengths[dataset_type][i],
-          model.input_label_indices_vector: dataset.label_vector_indices[dataset_type][i],
-          model.dropout_keep_prob: 1.
-        }
-        unary_scores, predictions = sess.run([model.unary_scores, model.predictions], feed_dict)
-        if parameters['use_crf']:
-            predictions, _ = tf.contrib.crf.viterbi_decode(unary_scores, transition_params_trained)
-            predictions = predictions[1:-1]
-        else:
-            predictions = predictions.tolist()
-
-        assert(len(predictions) == len(dataset.tokens[dataset_type][i]))
-        output_string = ''
-        prediction_labels = [dataset.index_to_label[prediction] for prediction in predictions]
-        gold_labels = dataset.labels[dataset_type][i]
-        if parameters['tagging_format'] == 'bioes':
-            prediction_labels = utils_nlp.bioes_to_bio(prediction_labels)
-            gold_labels = utils_nlp.bioes_to_bio(gold_labels)
-        for prediction, token, gold_label in zip(prediction_labels, dataset.tokens[dataset_type][i], gold_labels):
-            while True:
-                line = original_conll_file.readline()
-                split_line = line.strip().split(' ')
-                if '-DOCSTART-' in split_line[0] or len(split_line) == 0 or len(split_line[0]) == 0:
-                    continue
-                else:
-                    token_original = split_line[0]
-                    if parameters['tagging_format'] == 'bioes':
-                        split_line.pop()
-                    gold_label_original = split_line[-1]
-                    assert(token == token_original and gold_label == gold_label_original) 
-                    break            
-            split_line.append(prediction)
-            output_string += ' '.join(split_line) + '\n'
-        output_file.write(output_string+'\n')
-
-        all_predictions.extend(predictions)
+        if i not in predictions_per_sequence:
+            skip_sequence(dataset, dataset_type, i, original_conll_file)
+            continue
+        write_sequence_predictions(dataset, dataset_type, i, predictions_per_sequence[i], original_conll_file, output_file, parameters)
+        all_predictions.extend(predictions_per_sequence[i])
         all_y_true.extend(dataset.label_indices[dataset_type][i])
 
     output_file.close()
@@ -100,15 +207,25 @@ def prediction_step(sess, dataset, dataset_type, model, transition_params_traine
     return all_predictions, all_y_true, output_filepath
 
 
-def predict_labels(sess, model, transition_params_trained, parameters, dataset, epoch_number, stats_graph_folder, dataset_filepaths):
-    # Predict labels using trained model
+def predict_labels(sess, model, parameters, dataset, epoch_number, stats_graph_folder, dataset_filepaths, input_pipeline=None,
+                   dataset_types=None, sequence_numbers=None, character_lstm_cache=None):
+    '''
+    Predict labels using trained model, for each of dataset_types (by default, all of them).
+    sequence_numbers optionally maps a dataset type to the subset of its sequences to predict.
+    '''
+    if dataset_types is None:
+        dataset_types = ['train', 'valid', 'test', 'deploy']
+    if sequence_numbers is None:
+        sequence_numbers = {}
     y_pred = {}
     y_true = {}
     output_filepaths = {}
-    for dataset_type in ['train', 'valid', 'test', 'deploy']:
+    for dataset_type in dataset_types:
         if dataset_type not in dataset_filepaths.keys():
             continue
-        prediction_output = prediction_step(sess, dataset, dataset_type, model, transition_params_trained, stats_graph_folder, epoch_number, parameters, dataset_filepaths)
+        prediction_output = prediction_step(sess, dataset, dataset_type, model, stats_graph_folder, epoch_number, parameters, dataset_filepaths,
+                                            input_pipeline=input_pipeline, sequence_numbers=sequence_numbers.get(dataset_type),
+                                            character_lstm_cache=character_lstm_cache)
         y_pred[dataset_type], y_true[dataset_type], output_filepaths[dataset_type] = prediction_output
     return y_pred, y_true, output_filepaths
 
@@ -7,6 +7,7 @@ import os
 import time
 import datetime
 import shutil
+import sys
 
 def order_dictionary(dictionary, mode, reverse=False):
     '''
@@ -91,6 +92,27 @@ def get_current_time_in_seconds():
     '''
     return(time.strftime("%Y-%m-%d_%H-%M-%S", time.localtime()))
 
+def get_resident_memory():
+    '''
+    Resident memory of the current process in megabytes (the peak resident memory if the current one is not available),
+    or None on platforms where it cannot be measured.
+    '''
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except IOError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS, and in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
 def get_current_time_in_miliseconds():
     '''
     http://stackoverflow.com/questions/5998245/get-current-time-in-milliseconds-in-python
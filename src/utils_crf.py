@@ -0,0 +1,84 @@
+'''
+Vectorized Viterbi decoding of batches of CRF scores on the host, e.g. to decode again the unary scores of EntityLSTM with other transition parameters
+'''
+import numpy as np
+
+
+def viterbi_decode_batch(unary_scores, transition_params, sequence_lengths, number_of_best_paths=1):
+    '''
+    Find the number_of_best_paths highest scoring tag sequences of each sequence of a padded batch, all sequences at once.
+    unary_scores: [batch_size, max_sequence_length, number_of_tags]
+    transition_params: [number_of_tags, number_of_tags], where transition_params[i, j] is the score of tag j following tag i
+    sequence_lengths: [batch_size], the scores after the length of each sequence are ignored
+
+    Return the paths [batch_size, number_of_best_paths, max_sequence_length] (padded with 0 after the length of each sequence)
+    and their scores [batch_size, number_of_best_paths], from the best to the worst. When a sequence has fewer possible paths
+    than number_of_best_paths, the missing paths have a score of -inf.
+    With number_of_best_paths=1, the best path and its score are the same as with tf.contrib.crf.viterbi_decode, ties included.
+    '''
+    unary_scores = np.asarray(unary_scores)
+    transition_params = np.asarray(transition_params)
+    sequence_lengths = np.asarray(sequence_lengths)
+    batch_size, max_sequence_length, number_of_tags = unary_scores.shape
+    k = number_of_best_paths
+
+    # The scores are summed in the same precision as tf.contrib.crf.viterbi_decode
+    dtype = np.result_type(unary_scores.dtype, transition_params.dtype, np.float32)
+    # trellis[b, r, j]: score of the r-th best path of sequence b ending with tag j at the current time step
+    trellis = np.full([batch_size, k, number_of_tags], -np.inf, dtype=dtype)
+    trellis[:, 0, :] = unary_scores[:, 0, :]
+    # backpointers[t, b, r, j]: index (rank * number_of_tags + previous tag) of the predecessor of trellis[b, r, j] at time step t
+    backpointers = np.zeros([max_sequence_length, batch_size, k, number_of_tags], dtype=np.int64)
+    # After the end of a sequence, each path points to itself, so that the backtracking goes through the padding unchanged
+    identity_backpointers = np.arange(k * number_of_tags).reshape([k, number_of_tags])
+    for t in range(1, max_sequence_length):
+        # [batch_size, k * number_of_tags (rank and previous tag), number_of_tags (current tag)]
+        candidates = (trellis[:, :, :, np.newaxis] + transition_params).reshape([batch_size, k * number_of_tags, number_of_tags])
+        # A stable sort keeps the first of equal candidates, as np.argmax does in tf.contrib.crf.viterbi_decode
+        best_candidates = np.argsort(-candidates, axis=1, kind='mergesort')[:, :k, :]
+        new_trellis = np.take_along_axis(candidates, best_candidates, axis=1) + unary_scores[:, t, np.newaxis, :]
+        is_padding = (t >= sequence_lengths)[:, np.newaxis, np.newaxis]
+        trellis = np.where(is_padding, trellis, new_trellis)
+        backpointers[t] = np.where(is_padding, identity_backpointers, best_candidates)
+
+    final_scores = trellis.reshape([batch_size, k * number_of_tags])
+    best_final = np.argsort(-final_scores, axis=1, kind='mergesort')[:, :k]
+    scores = np.take_along_axis(final_scores, best_final, axis=1)
+    paths = np.zeros([batch_size, k, max_sequence_length], dtype=np.int64)
+    batch_indices = np.arange(batch_size)[:, np.newaxis]
+    current = best_final
+    for t in range(max_sequence_length - 1, -1, -1):
+        paths[:, :, t] = current % number_of_tags
+        if t > 0:
+            current = backpointers[t][batch_indices, current // number_of_tags, current % number_of_tags]
+    paths *= np.arange(max_sequence_length) < sequence_lengths[:, np.newaxis, np.newaxis]
+    return paths, scores
+
+
+def add_start_and_end_scores(unary_scores, sequence_lengths, small_score=-1000.0, large_score=0.0):
+    '''
+    Add the start and end tags to the unary scores [batch_size, max_sequence_length, number_of_classes] as EntityLSTM does before the CRF layer:
+    the start tag (index number_of_classes) is at time step 0 and the end tag (index number_of_classes + 1) right after the last token of each sequence.
+    Return the scores [batch_size, max_sequence_length + 2, number_of_classes + 2].
+    '''
+    unary_scores = np.asarray(unary_scores)
+    batch_size, max_sequence_length, number_of_classes = unary_scores.shape
+    unary_scores_with_start_and_end = np.full([batch_size, max_sequence_length + 2, number_of_classes + 2], small_score,
+                                              dtype=np.result_type(unary_scores.dtype, np.float32))
+    unary_scores_with_start_and_end[:, 1:-1, :number_of_classes] = unary_scores
+    unary_scores_with_start_and_end[:, 0, number_of_classes] = large_score
+    for b, sequence_length in enumerate(sequence_lengths):
+        unary_scores_with_start_and_end[b, sequence_length + 1, :] = small_score
+        unary_scores_with_start_and_end[b, sequence_length + 1, number_of_classes + 1] = large_score
+    return unary_scores_with_start_and_end
+
+
+def crf_decode_batch(unary_scores, transition_params, sequence_lengths, number_of_best_paths=1):
+    '''
+    Decode the unary scores of EntityLSTM (model.unary_scores with use_crf), which include the start and end tags:
+    unary_scores is [batch_size, max_sequence_length + 2, number_of_classes + 2], and sequence_lengths are the numbers of tokens of the sequences.
+    Return the paths [batch_size, number_of_best_paths, max_sequence_length] without the start and end tags, and their scores.
+    '''
+    paths, scores = viterbi_decode_batch(unary_scores, transition_params, np.asarray(sequence_lengths) + 2, number_of_best_paths=number_of_best_paths)
+    paths = paths[:, :, 1:-1] * (np.arange(paths.shape[2] - 2) < np.asarray(sequence_lengths)[:, np.newaxis, np.newaxis])
+    return paths, scores